@@ -0,0 +1,445 @@
+#!/usr/bin/python3
+"""Carry out the marked remove/use-original decisions in one go.
+
+In mark mode (Shift+M) the app only records what should happen to each
+image. Committing (Control+Return) turns the marks into steps (see
+WallpaperFiles) and runs them as a batch:
+
+- Steps for different images run concurrently (up to batchThreads at once)
+- Nothing is deleted: removed and overwritten files are moved into a
+  .trash/<batch> folder next to them, so the batch can be undone (as are
+  the files the batch wrote, when it is undone)
+- Every step is recorded in a journal (in .batches in the wallpaper
+  folder) before and after it runs, so an interrupted batch can be
+  resumed or undone
+
+If a step fails, the whole batch is undone. A batch is not undone if a
+file it wrote has been changed since (eg. re-cropped).
+
+	python3 BatchCommit.py list|undo|resume|purge [journal]
+
+undo, resume and purge (delete the trash) use the latest batch by default.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+	except Exception:
+		from PySide.QtCore import *
+from WallpaperFiles import *
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+import concurrent.futures
+
+
+def _fsyncDir(path):
+	try:
+		fd = os.open(path, os.O_RDONLY)
+	except OSError:
+		return # eg. Windows
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+
+def _removeEmptyDirs(path):
+	# remove the batch trash folder, then .trash, if they are empty
+	for p in (path, os.path.dirname(path)):
+		try:
+			os.rmdir(p)
+		except OSError:
+			return
+
+
+class BatchJournal:
+	"""The record of a batch.
+
+	The first line lists every step. Each following line records progress
+	of one step ("start" with whether the destination existed, "trashed"
+	once an existing destination has been moved aside, "done" with the
+	size and modification time of the destination) or of the whole batch
+	("committed", "undone", "purged").
+
+	Only the records that have to be on disk before a file is moved (and
+	the batch state) are synced. Threads waiting to sync share one fsync,
+	as the journal is usually on the same (slow) share as the images.
+	"""
+
+	path = None
+	batch = None
+	steps = None
+	file = None
+	lock = None
+	syncLock = None
+	appended = 0	# records written
+	synced = 0		# records known to be on disk
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.syncLock = threading.Lock()
+
+	@staticmethod
+	def create(path, batch, steps):
+		journal = BatchJournal(path)
+		journal.batch = batch
+		journal.steps = steps
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		journal.write(sync=True, batch=batch, steps=steps)
+		return journal
+
+	def read(self):
+		"""Returns the progress of each step and the state of the batch"""
+		progress = {}
+		state = set()
+		with open(self.path) as f:
+			header = json.loads(f.readline())
+			self.batch = header["batch"]
+			self.steps = header["steps"]
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					continue # partially written line from a crash
+				if "step" in entry:
+					progress.setdefault(entry["step"], {}).update(entry)
+				else:
+					state.update(entry)
+		return progress, state
+
+	def write(self, sync=False, **entry):
+		"""Add a record, waiting until it is on disk if sync is set"""
+		with self.lock:
+			if self.file is None:
+				self.file = open(self.path, "a")
+			self.file.write(json.dumps(entry) + "\n")
+			self.file.flush()
+			self.appended += 1
+			record = self.appended
+		if sync:
+			self.sync(record)
+
+	def sync(self, record=None):
+		"""Wait until the records (up to record) are on disk"""
+		with self.syncLock:
+			if record is not None and self.synced >= record:
+				return # synced by another thread
+			with self.lock:
+				if self.file is None:
+					return
+				record = self.appended
+				fd = self.file.fileno()
+			os.fsync(fd)
+			self.synced = record
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
+class Batch:
+	"""Steps for a set of images that are committed together.
+
+	Call add() with the steps for each image, then commit().
+	"""
+
+	journalDir = None
+	threads = 8
+	chains = None
+
+	def __init__(self, journalDir, threads=None):
+		self.journalDir = journalDir
+		if threads:
+			self.threads = threads
+		self.chains = []
+
+	def add(self, steps):
+		"""Add the steps for one image (they are run in order)"""
+		if steps:
+			self.chains.append(list(steps))
+
+	def _groups(self, steps):
+		"""Groups the steps of images that touch the same files.
+
+		Each group has to run in order, but groups can run concurrently.
+		"""
+		parent = {}
+		def find(chain):
+			while parent.get(chain, chain) != chain:
+				chain = parent[chain]
+			return chain
+		owner = {}
+		for step in steps:
+			for path in (step["src"], step["dst"]):
+				if path is not None:
+					other = owner.setdefault(path, step["chain"])
+					parent[find(step["chain"])] = find(other)
+		groups = {}
+		for i, step in enumerate(steps):
+			groups.setdefault(find(step["chain"]), []).append(i)
+		return list(groups.values())
+
+	def commit(self, encoder=None):
+		"""Run the steps, returning the journal path.
+
+		If anything fails the batch is undone and the exception raised.
+		"""
+		batch = time.strftime("%Y%m%d-%H%M%S")
+		if os.path.exists("%s/%s.journal" % (self.journalDir, batch)):
+			batch += "-%d" % len(journals(self.journalDir))
+		steps = []
+		for chain, chainSteps in enumerate(self.chains):
+			for op, src, dst in chainSteps:
+				steps.append({"chain": chain, "op": op, "src": src, "dst": dst})
+		for i, step in enumerate(steps):
+			# where a removed or overwritten file is kept
+			path = step["src"] if step["op"] == "remove" else step["dst"]
+			step["trash"] = "%s/.trash/%s/%d-%s" % (
+				os.path.dirname(path), batch, i, os.path.basename(path))
+
+		journalPath = "%s/%s.journal" % (self.journalDir, batch)
+		journal = BatchJournal.create(journalPath, batch, steps)
+		if encoder is None:
+			encoder = JpegEncoder.fromSettings()
+
+		# one trip per folder to create the trash folders
+		folders = set(os.path.dirname(step["trash"]) for step in steps)
+		for folder in folders:
+			os.makedirs(folder, exist_ok=True)
+
+		start = time.time()
+		failed = threading.Event()
+		def runGroup(group):
+			for i in group:
+				if failed.is_set():
+					return
+				_runStep(journal, i, steps[i], encoder)
+		error = None
+		with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+			futures = [pool.submit(runGroup, g) for g in self._groups(steps)]
+			for future in concurrent.futures.as_completed(futures):
+				try:
+					future.result()
+				except Exception as e:
+					failed.set()
+					error = error or e
+
+		# one sync per folder, rather than per file
+		for folder in set(os.path.dirname(os.path.dirname(f)) for f in folders):
+			_fsyncDir(folder)
+
+		if error is not None:
+			print("Batch failed (%s), undoing it" % error)
+			journal.close()
+			undo(journalPath)
+			raise error
+
+		journal.write(sync=True, committed=True)
+		journal.close()
+		for folder in folders:
+			_removeEmptyDirs(folder)
+		print("Committed %d step(s) for %d image(s) in %.1fs (%s)" % (
+			len(steps), len(self.chains), time.time() - start, journalPath))
+		return journalPath
+
+
+def _written(path):
+	"""What a step wrote, to check it hasn't changed before undoing it"""
+	st = os.stat(path)
+	return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+def _undoneTrash(step):
+	# where a file written by the batch is kept when it is undone
+	return os.path.join(os.path.dirname(step["trash"]), "undone-" + os.path.basename(step["trash"]))
+
+def _changed(steps, progress):
+	"""Returns the files written by the batch that have changed since"""
+	expected = {}
+	for i, step in enumerate(steps):
+		p = progress.get(i, {})
+		if step["src"] in expected and step["op"] in ("move", "remove"):
+			del expected[step["src"]]
+		if step["dst"] is not None and "size" in p:
+			expected[step["dst"]] = p
+	changed = []
+	for path, p in expected.items():
+		try:
+			if _written(path) != {"size": p["size"], "mtime": p["mtime"]}:
+				changed.append(path)
+		except OSError:
+			changed.append(path)
+	return changed
+
+def _runStep(journal, i, step, encoder):
+	op, src, dst = step["op"], step["src"], step["dst"]
+	if op == "remove":
+		journal.write(sync=True, step=i, start=True, existed=False)
+		shutil.move(src, step["trash"])
+	else:
+		existed = os.path.lexists(dst)
+		# a new destination can be left behind if the record is lost, but a
+		# moved source or an existing destination can't
+		journal.write(sync=existed or op == "move", step=i, start=True, existed=existed)
+		if existed:
+			shutil.move(dst, step["trash"])
+			journal.write(step=i, trashed=True)
+		runStep((op, src, dst), encoder)
+	if op == "remove":
+		journal.write(step=i, done=True)
+	else:
+		journal.write(step=i, done=True, **_written(dst))
+
+def _applied(step, progress):
+	"""True if the step was carried out (or got far enough to need undoing)"""
+	if progress.get("done"):
+		return True
+	if not progress.get("start"):
+		return False
+	op, src, dst = step["op"], step["src"], step["dst"]
+	if op == "remove":
+		return not os.path.lexists(src) and os.path.lexists(step["trash"])
+	if op == "move":
+		return not os.path.lexists(src) and os.path.lexists(dst)
+	# copy and convert replace dst in one step
+	if progress.get("existed") and not os.path.lexists(step["trash"]):
+		return False # dst is still the old file
+	return os.path.lexists(dst)
+
+def undo(journalPath):
+	"""Put everything back the way it was before the batch"""
+	journal = BatchJournal(journalPath)
+	progress, state = journal.read()
+	if "undone" in state:
+		print("Batch already undone")
+		return
+	if "purged" in state:
+		raise Exception("Can not undo, the trash has been deleted")
+	changed = _changed(journal.steps, progress)
+	if changed:
+		raise Exception("Can not undo, changed since the batch: " + ", ".join(changed))
+
+	folders = set()
+	for i in reversed(range(len(journal.steps))):
+		step = journal.steps[i]
+		p = progress.get(i, {})
+		op, src, dst, trash = step["op"], step["src"], step["dst"], step["trash"]
+		folders.add(os.path.dirname(trash))
+		if _applied(step, p):
+			if op == "remove":
+				shutil.move(trash, src)
+			elif op == "move":
+				shutil.move(dst, src)
+			else:
+				shutil.move(dst, _undoneTrash(step))
+		# put back an overwritten file
+		if op != "remove" and p.get("existed") and os.path.lexists(trash):
+			shutil.move(trash, dst)
+	journal.write(sync=True, undone=True)
+	journal.close()
+	for folder in folders:
+		_removeEmptyDirs(folder)
+	print("Undone batch "+journal.batch)
+
+def resume(journalPath, encoder=None):
+	"""Finish an interrupted batch"""
+	journal = BatchJournal(journalPath)
+	progress, state = journal.read()
+	if state & {"committed", "undone", "purged"}:
+		print("Batch already finished")
+		return
+	if encoder is None:
+		encoder = JpegEncoder.fromSettings()
+	for i, step in enumerate(journal.steps):
+		p = progress.get(i, {})
+		if _applied(step, p):
+			if not p.get("done"):
+				if step["op"] == "remove":
+					journal.write(step=i, done=True)
+				else:
+					journal.write(step=i, done=True, **_written(step["dst"]))
+			continue
+		os.makedirs(os.path.dirname(step["trash"]), exist_ok=True)
+		if step["op"] != "remove" and p.get("existed") and os.path.lexists(step["trash"]):
+			# the old file was already moved aside
+			runStep((step["op"], step["src"], step["dst"]), encoder)
+			journal.write(step=i, done=True, **_written(step["dst"]))
+		else:
+			_runStep(journal, i, step, encoder)
+	journal.write(sync=True, committed=True)
+	journal.close()
+	print("Resumed batch "+journal.batch)
+
+def purge(journalPath):
+	"""Delete the trash of a committed (or undone) batch (it can't be undone after this)"""
+	journal = BatchJournal(journalPath)
+	progress, state = journal.read()
+	if not state & {"committed", "undone"} or "purged" in state:
+		print("Only committed or undone batches can be purged")
+		return
+	for folder in set(os.path.dirname(step["trash"]) for step in journal.steps):
+		shutil.rmtree(folder, ignore_errors=True)
+		_removeEmptyDirs(os.path.dirname(folder))
+	journal.write(sync=True, purged=True)
+	journal.close()
+	print("Purged batch "+journal.batch)
+
+def journals(journalDir):
+	"""Returns the journal paths, oldest first"""
+	if not os.path.isdir(journalDir):
+		return []
+	return [journalDir + "/" + f for f in sorted(os.listdir(journalDir)) if f.endswith(".journal")]
+
+def unfinished(journalDir):
+	"""Returns the journals of batches that were interrupted"""
+	result = []
+	for path in journals(journalDir):
+		progress, state = BatchJournal(path).read()
+		if not state:
+			result.append(path)
+	return result
+
+
+def main():
+	QCoreApplication.setOrganizationName("OpenGear")
+	QCoreApplication.setApplicationName("WallpaperHelper")
+	settings = QSettings()
+
+	parser = argparse.ArgumentParser(description="Manage batches of marked images")
+	parser.add_argument("command", choices=["list", "undo", "resume", "purge"])
+	parser.add_argument("journal", nargs="?", default=None)
+	parser.add_argument("-w", "--wallpaper", default=settings.value("wallpaper"))
+	args = parser.parse_args()
+
+	journalDir = str(args.wallpaper) + "/.batches"
+	if args.command == "list":
+		for path in journals(journalDir):
+			progress, state = BatchJournal(path).read()
+			print("%s: %s" % (path, ", ".join(sorted(state)) or "interrupted"))
+		return 0
+
+	journal = args.journal
+	if journal is None:
+		paths = journals(journalDir)
+		if not paths:
+			parser.error("No batches in "+journalDir)
+		journal = paths[-1]
+	if args.command == "undo":
+		undo(journal)
+	elif args.command == "resume":
+		resume(journal)
+	else:
+		purge(journal)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+"""Convert all non-JPEG wallpapers to .jpg in one go.
+
+This does the same as pressing Control+R on every non-JPEG image in the
+wallpaper folder (the original is moved to the originals folder if needed
+and a .jpg wallpaper is written), but uses a pool of processes.
+
+Progress is written to a journal (.convert-journal in the wallpaper folder
+by default) so an interrupted run carries on where it stopped. Delete the
+journal to start from scratch.
+
+	python3 BulkConvert.py [-w wallpaper] [-o originals] [-j jobs] [--journal file]
+
+The wallpaper and originals paths (and JPEG options) default to the ones
+set in the app.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+	except Exception:
+		from PySide.QtCore import *
+from WallpaperFiles import *
+import os
+import time
+import json
+import argparse
+import concurrent.futures
+
+
+def findUnconverted(wallpaperPath):
+	"""Returns the non-JPEG images in the wallpaper folder"""
+	files = [f for f in sorted(os.listdir(wallpaperPath)) if isImage(f)]
+	return [f for f in files if not f.endswith(".jpg")]
+
+def convertFiles(files, originalsPath, wallpaperPath, encoder):
+	"""Convert a group of files that all produce the same .jpg
+
+	They are converted in order so the result is the same as if they
+	were converted by hand. Runs in a worker process.
+	"""
+	start = time.time()
+	size = 0
+	for f in files:
+		imagePath = wallpaperPath + "/" + f
+		backupPath, wallpaperFile = getPaths(imagePath, originalsPath, wallpaperPath)
+		# a resumed file may have been moved to the originals already
+		if os.path.isfile(imagePath):
+			size += os.path.getsize(imagePath)
+		elif os.path.isfile(backupPath):
+			size += os.path.getsize(backupPath)
+		else:
+			raise Exception("Missing "+imagePath)
+		useOriginalImage(imagePath, backupPath, wallpaperFile, encoder)
+	return size, time.time() - start
+
+
+class Journal:
+	"""Append-only record of the files that have been converted.
+
+	Each line is a JSON object. A file is "queued" before it is handed to
+	a worker and "done" (or "failed") once the worker has finished.
+	"""
+
+	path = None
+	file = None
+
+	def __init__(self, path):
+		self.path = path
+
+	def pending(self):
+		"""Returns the files that were queued but never finished"""
+		queued = []
+		finished = set()
+		if not os.path.isfile(self.path):
+			return queued
+		with open(self.path) as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					continue # partially written line from a crash
+				if entry["state"] == "queued":
+					queued.append(entry["file"])
+				else:
+					finished.add(entry["file"])
+		return [f for f in queued if f not in finished]
+
+	def write(self, state, file, **extra):
+		if self.file is None:
+			self.file = open(self.path, "a")
+		extra["state"] = state
+		extra["file"] = file
+		self.file.write(json.dumps(extra) + "\n")
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
+def bulkConvert(originalsPath, wallpaperPath, encoder, jobs=None, journalPath=None):
+	if journalPath is None:
+		journalPath = wallpaperPath + "/.convert-journal"
+	journal = Journal(journalPath)
+
+	# resume anything that was interrupted, then pick up anything new
+	files = journal.pending()
+	resumed = set(files)
+	for f in findUnconverted(wallpaperPath):
+		if f not in resumed:
+			files.append(f)
+	if resumed:
+		print("Resuming %d interrupted file(s)" % len(resumed))
+	if not files:
+		print("Nothing to convert")
+		return 0
+
+	# files that produce the same .jpg must be done by the same worker
+	groups = {}
+	for f in files:
+		groups.setdefault(forceJpeg(f), []).append(f)
+
+	failed = 0
+	done = 0
+	totalBytes = 0
+	start = time.time()
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+		futures = {}
+		for group in groups.values():
+			for f in group:
+				if f not in resumed:
+					journal.write("queued", f)
+			futures[pool.submit(convertFiles, group, originalsPath, wallpaperPath, encoder)] = group
+		for future in concurrent.futures.as_completed(futures):
+			group = futures[future]
+			try:
+				size, seconds = future.result()
+			except Exception as e:
+				print("Failed to convert %s: %s" % (", ".join(group), e))
+				for f in group:
+					journal.write("failed", f, error=str(e))
+				failed += len(group)
+				continue
+			for f in group:
+				journal.write("done", f, bytes=size, seconds=round(seconds, 3))
+			done += len(group)
+			totalBytes += size
+			elapsed = time.time() - start
+			print("%d/%d converted, %.1f files/s, %.1f MB/s" % (
+				done, len(files), done / elapsed, totalBytes / elapsed / 1e6))
+	journal.close()
+
+	elapsed = time.time() - start
+	print("Converted %d file(s) (%.1f MB) in %.1fs, %d failed" % (
+		done, totalBytes / 1e6, elapsed, failed))
+	return failed
+
+
+def main():
+	QCoreApplication.setOrganizationName("OpenGear")
+	QCoreApplication.setApplicationName("WallpaperHelper")
+	settings = QSettings()
+
+	parser = argparse.ArgumentParser(description="Convert non-JPEG wallpapers to .jpg")
+	parser.add_argument("-w", "--wallpaper", default=settings.value("wallpaper"))
+	parser.add_argument("-o", "--originals", default=settings.value("originals"))
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+	parser.add_argument("--journal", default=None, help="journal file (to resume an interrupted run)")
+	parser.add_argument("-q", "--quality", type=int, default=None, help="JPEG quality (0-100)")
+	parser.add_argument("--target-size", type=parseSize, default=None, help="largest JPEG size (eg. 800k)")
+	parser.add_argument("--target-psnr", type=float, default=None, help="smallest JPEG PSNR in dB (eg. 40)")
+	parser.add_argument("--progressive", action="store_true", help="write progressive JPEGs")
+	parser.add_argument("--optimize", action="store_true", help="write optimised Huffman tables")
+	args = parser.parse_args()
+	if not args.wallpaper or not args.originals:
+		parser.error("Both the wallpaper and originals paths must be set!")
+
+	encoder = JpegEncoder.fromSettings()
+	if args.quality is not None: encoder.quality = args.quality
+	if args.target_size is not None: encoder.targetBytes = args.target_size
+	if args.target_psnr is not None: encoder.targetPsnr = args.target_psnr
+	if args.progressive: encoder.progressive = True
+	if args.optimize: encoder.optimize = True
+
+	failed = bulkConvert(args.originals, args.wallpaper, encoder, args.jobs, args.journal)
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
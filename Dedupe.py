@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""Link uncropped wallpapers to their originals.
+
+An uncropped JPEG wallpaper is an exact copy of its original, so it can
+share the original's storage. This replaces each such wallpaper with a
+hard link (or a copy-on-write reflink) to the original.
+
+	python3 Dedupe.py [-w wallpaper] [-o originals] [-m hardlink|reflink] [-n]
+
+The paths and storage mode default to the ones set in the app.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+	except Exception:
+		from PySide.QtCore import *
+from WallpaperFiles import *
+import os
+import filecmp
+import argparse
+
+
+def dedupe(originalsPath, wallpaperPath, mode, dryRun=False):
+	linked = 0
+	saved = 0
+	for f in sorted(os.listdir(wallpaperPath)):
+		if not isImage(f) or not f.endswith(".jpg"):
+			continue
+		backupPath, wallpaperFile = getPaths(f, originalsPath, wallpaperPath)
+		if not os.path.isfile(backupPath):
+			continue
+		if os.path.samefile(backupPath, wallpaperFile):
+			continue # already linked
+		size = os.path.getsize(wallpaperFile)
+		if size != os.path.getsize(backupPath) or \
+				not filecmp.cmp(backupPath, wallpaperFile, shallow=False):
+			continue # cropped
+		if dryRun:
+			print("Would link "+wallpaperFile)
+		else:
+			stored = storeCopy(backupPath, wallpaperFile, mode, fallback=False)
+			if stored == STORE_COPY:
+				print("Can not link %s (%s not supported?), left as it is" % (wallpaperFile, mode))
+				continue
+			print("Linked %s (%s)" % (wallpaperFile, stored))
+		linked += 1
+		saved += size
+
+	print("%s %d wallpaper(s), saving %.1f MB" % (
+		"Would link" if dryRun else "Linked", linked, saved / 1e6))
+
+
+def main():
+	QCoreApplication.setOrganizationName("OpenGear")
+	QCoreApplication.setApplicationName("WallpaperHelper")
+	settings = QSettings()
+	mode = storageMode()
+	if mode == STORE_COPY:
+		mode = STORE_HARDLINK
+
+	parser = argparse.ArgumentParser(description="Link uncropped wallpapers to their originals")
+	parser.add_argument("-w", "--wallpaper", default=settings.value("wallpaper"))
+	parser.add_argument("-o", "--originals", default=settings.value("originals"))
+	parser.add_argument("-m", "--mode", choices=[STORE_HARDLINK, STORE_REFLINK], default=mode)
+	parser.add_argument("-n", "--dry-run", action="store_true", help="only report what would be linked")
+	args = parser.parse_args()
+	if not args.wallpaper or not args.originals:
+		parser.error("Both the wallpaper and originals paths must be set!")
+
+	dedupe(args.originals, args.wallpaper, args.mode, args.dry_run)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
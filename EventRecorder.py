@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""Records the input events handled by the app, for Replay.py.
+
+Set WALLPAPER_RECORD to a file name to record a session:
+
+	WALLPAPER_RECORD=session.jsonl ./wallpaper
+
+Each line of the file is a JSON object with the event type, the time
+(in seconds since the first event) and the event details.
+"""
+
+import os
+import json
+import time
+import atexit
+
+recordPath = os.environ.get("WALLPAPER_RECORD")
+_file = None
+_start = None
+
+
+def toInt(value):
+	"""Qt enums and flags as an int"""
+	try:
+		return int(value)
+	except TypeError:
+		return value.value # PySide 6 flags
+
+def recordEvent(kind, **values):
+	"""Records an event if recording is enabled"""
+	global _file, _start
+	if not recordPath:
+		return
+	if _file is None:
+		_file = open(recordPath, "w")
+		_start = time.perf_counter()
+		atexit.register(_file.close)
+	values["type"] = kind
+	values["t"] = round(time.perf_counter() - _start, 4)
+	_file.write(json.dumps(values) + "\n")
+
+def recordStart(**values):
+	"""Records where the session starts from (once, before any events)"""
+	if _file is None:
+		recordEvent("start", **values)
+
+def recordKey(e):
+	recordEvent("key", key=toInt(e.key()), modifiers=toInt(e.modifiers()))
+
+def recordMouse(kind, e):
+	recordEvent(kind, x=e.pos().x(), y=e.pos().y(),
+		button=toInt(e.button()), buttons=toInt(e.buttons()),
+		modifiers=toInt(e.modifiers()))
+
+def recordWheel(e):
+	try:
+		pos = e.position().toPoint()
+		delta = e.angleDelta().y()
+	except Exception:
+		pos = e.pos() # PySide
+		delta = e.delta()
+	recordEvent("wheel", x=pos.x(), y=pos.y(), delta=delta,
+		modifiers=toInt(e.modifiers()))
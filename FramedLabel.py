@@ -14,6 +14,32 @@ except Exception:
 		from PySide.QtCore import *
 		from PySide.QtGui import *
 from QPainter import *
+from JpegEncoder import *
+from EventRecorder import *
+from ImageFill import *
+from WallpaperFiles import loadImage
+from StagingCache import stagedPath, stageWritten
+import importlib.util
+import concurrent.futures
+
+PROXY_SIZE = 2560		# minimum size of the display copy of large images
+OVERSCAN = 0.5			# how far past the padded image the crop can go (fraction)
+MAX_ANGLE = 45			# straightening limit (degrees)
+ROTATED_PROXIES = 8		# number of rotated proxies to keep
+PRERENDER_DELAY = 250	# ms without changes before the preview is rendered ahead of time
+
+def _scaleForDisplay(image, size):
+	return image.scaled(size.width(), size.height(), Qt.KeepAspectRatio)
+
+def _renderPreview(paddedImage, rect, size):
+	preview = paddedImage.copy(rect)
+	return preview, _scaleForDisplay(preview, size), size
+
+def _renderOriginal(path, size):
+	# only the display size copy is kept
+	with stagedPath(path) as local:
+		original = _scaleForDisplay(loadImage(local), size)
+	return original, original, size
 
 class FramedLabel(QLabel):
 	"""Label that draws a crop indication on an image.
@@ -28,11 +54,34 @@ class FramedLabel(QLabel):
 	desktopWidth = 1
 	desktopHeight = 1
 	originalImage = None	# as-loaded
-	paddedImage = None		# padded so that the whole picture can be seen after clipping
+	rotation = 0			# quarter turns clockwise
+	angle = 0.0				# extra rotation to straighten the image (degrees)
+	flipped = False			# mirrored horizontally (after rotating)
+	sourceSize = None		# size of the original after rotating
+	baseProxy = None		# the original scaled down for display
+	rotatedProxies = None	# rotation -> baseProxy rotated
+	proxyImage = None		# the rotated proxy
+	proxyScale = 1.0		# proxyImage size / sourceSize
+	proxyLimit = PROXY_SIZE	# longest side of the proxy (and padded proxy)
+	paddedSize = None		# padded so that the whole picture can be seen after clipping
+	paddingMargin = None	# extra padding when overscan is on
+	imageOffset = None		# where the original is in the padded image
+	paddedImage = None		# the padded image at proxy size
 	clipRect = None			# defaults to part of the image (no padding visible)
 	preview = None			# a clipped copy of the image for better "full screen" preview
 	scaledImage = None		# the padded image scaled for display
+	paddedPixmap = None		# (size, scaledImage, pixmap) for switching back from a preview
 	paddingBackground = Qt.black
+	fillMode = FILL_SOLID	# how the padding inside the crop is filled
+	overscan = False		# allow the crop border to go past the padded image
+	filledProxy = None		# (key, padded proxy image filled using fillMode)
+	blurred = None			# for FILL_BLUR
+	prerenderer = None		# renders the preview and original in the background
+	prerenderTimer = None	# started when the preview changes
+	previewKey = None		# what the preview was rendered from
+	paddedKey = None		# what paddedImage was drawn from (the crop can move without redrawing it)
+	previewRender = None	# future (preview, scaled, size)
+	originalRender = None	# (path, future (scaled original, scaled original, size))
 
 	movingFrame = False
 	tmpEraseRect = None		# for drawing the drag
@@ -43,16 +92,81 @@ class FramedLabel(QLabel):
 	def __init__(self, text: str):
 		super().__init__(text)
 		self.setMinimumSize(1, 1) # allow resizing smaller
+		self.prerenderer = concurrent.futures.ThreadPoolExecutor(2)
+		self.prerenderTimer = QTimer(self)
+		self.prerenderTimer.setSingleShot(True)
+		self.prerenderTimer.setInterval(PRERENDER_DELAY)
+		self.prerenderTimer.timeout.connect(self._prerenderPreview)
 
 	def setText(self, text):
 		self.originalImage = self.paddedImage = self.clipRect = self.preview = self.scaledImage = None
+		self.proxyImage = self.baseProxy = self.rotatedProxies = self.filledProxy = self.blurred = None
+		self._cancelRenders()
+		self.paddedPixmap = self.previewKey = None
+		self.prerenderTimer.stop()
 		super().setText(text)
 
 	def setImage(self, image: QImage):
 		self.originalImage = image
+		self.baseProxy = self._makeProxy(image)
+		self.rotatedProxies = {}
+		self.rotation = 0
+		self.angle = 0.0
+		self.flipped = False
+		self._setRotatedProxy()
 		self.preview = None
+		self.previewKey = None
+		self._cancelRenders()
 		self._resetImage()
 
+	def _transform(self):
+		transform = QTransform()
+		transform.rotate(self.rotation * 90 + self.angle)
+		if self.flipped:
+			transform = transform * QTransform.fromScale(-1, 1)
+		return transform
+
+	def _rotateImage(self, image):
+		if not (self.rotation or self.angle or self.flipped):
+			return image
+		# quarter turns and flips just move the pixels around
+		mode = Qt.SmoothTransformation if self.angle else Qt.FastTransformation
+		return image.transformed(self._transform(), mode)
+
+	def _setRotatedProxy(self):
+		"""Rotated proxies are kept, so that rotating back is instant"""
+		key = (self.rotation, self.angle, self.flipped)
+		proxy = self.rotatedProxies.pop(key, None)
+		if proxy is None:
+			proxy = self._rotateImage(self.baseProxy)
+		self.rotatedProxies[key] = proxy # most recently used last
+		while len(self.rotatedProxies) > ROTATED_PROXIES:
+			del self.rotatedProxies[next(iter(self.rotatedProxies))]
+
+		self.proxyImage = proxy
+		self.sourceSize = self._transform().mapRect(QRect(QPoint(0, 0), self.originalImage.size())).size()
+		self.proxyScale = proxy.width() / float(self.sourceSize.width())
+		self.filledProxy = self.blurred = None
+
+	def _makeProxy(self, image):
+		"""Large images are displayed (and dragged around) using a smaller copy"""
+		limit = PROXY_SIZE
+		try:
+			screen = QGuiApplication.primaryScreen()
+			size = screen.size()
+			limit = max(limit, int(max(size.width(), size.height()) * screen.devicePixelRatio()))
+		except Exception:
+			pass
+		self.proxyLimit = limit
+		if max(image.width(), image.height()) <= limit:
+			return image
+		return image.scaled(limit, limit, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+	def _paddedScale(self):
+		"""Scale of the padded proxy, which can be smaller than the proxy when overscanning"""
+		longest = max(self.paddedSize.width(), self.paddedSize.height())
+		return min(self.proxyScale, self.proxyLimit / float(longest))
+
 	def setDesktop(self, width: int, height: int):
 		self.desktopWidth = width
 		self.desktopHeight = height
@@ -64,31 +178,28 @@ class FramedLabel(QLabel):
 			self.paddedImage = self.clipRect = None
 			return
 
-		imageSize = self.originalImage.size()
+		imageSize = self.sourceSize
 		clipWidth = imageSize.width()
 		clipHeight = imageSize.height()
-		paddedWidth = imageSize.width()
-		paddedHeight = imageSize.height()
 		if imageSize.width() / float(imageSize.height()) > self.desktopWidth / float(self.desktopHeight):
 			clipWidth = int(imageSize.height() / float(self.desktopHeight) * self.desktopWidth) + 1
-			paddedHeight = int(paddedWidth / float(self.desktopWidth) * self.desktopHeight) + 1
 		else:
 			clipHeight = int(imageSize.width() / float(self.desktopWidth) * self.desktopHeight) + 1
-			paddedWidth = int(paddedHeight / float(self.desktopHeight) * self.desktopWidth) + 1
+		self._setPaddedSize()
 		#print(f"imageSize   {imageSize.width()} {imageSize.height()}")
 		#print(f"clip size   {clipWidth} {clipHeight}")
-		#print(f"padded size {paddedWidth} {paddedHeight}")
+		#print(f"padded size {self.paddedSize}")
 
-		x = (paddedWidth / 2) - (clipWidth / 2)
+		x = (self.paddedSize.width() / 2) - (clipWidth / 2)
 		if x < 0: x = 0
-		y = (paddedHeight / 2) - (clipHeight / 2)
+		y = (self.paddedSize.height() / 2) - (clipHeight / 2)
 		if y < 0: y = 0
 
 		self.clipRect = QRect(x, y, clipWidth, clipHeight)
 		self._setPaddedFromImage()
 
-	def _setPaddedFromImage(self):
-		imageSize = self.originalImage.size()
+	def _setPaddedSize(self):
+		imageSize = self.sourceSize
 		paddedWidth = imageSize.width()
 		paddedHeight = imageSize.height()
 		if imageSize.width() / float(imageSize.height()) > self.desktopWidth / float(self.desktopHeight):
@@ -102,33 +213,150 @@ class FramedLabel(QLabel):
 		y = (paddedHeight / 2) - (imageSize.height() / 2)
 		if y < 0: y = 0
 
-		scaledPixmap = QPixmap(paddedWidth, paddedHeight)
+		self.paddingMargin = QPoint(0, 0)
+		if self.overscan:
+			self.paddingMargin = QPoint(int(paddedWidth * OVERSCAN), int(paddedHeight * OVERSCAN))
+			paddedWidth += 2 * self.paddingMargin.x()
+			paddedHeight += 2 * self.paddingMargin.y()
+			x += self.paddingMargin.x()
+			y += self.paddingMargin.y()
+		self.paddedSize = QSize(paddedWidth, paddedHeight)
+		self.imageOffset = QPointF(x, y)
+
+	def _setPaddedFromImage(self):
+		self._setPaddedSize()
+
+		# draw the proxy, in full size coordinates
+		scale = self._paddedScale()
+		scaledPixmap = QPixmap(
+			max(1, round(self.paddedSize.width() * scale)),
+			max(1, round(self.paddedSize.height() * scale)))
 		scaledPixmap.fill(self.palette().color(self.backgroundRole()))
 		with QPainter(scaledPixmap) as p:
+			p.scale(scale, scale)
 			p.setPen(self.paddingBackground)
 			p.setBrush(self.paddingBackground)
-			p.drawRect(self.clipRect)
-			p.drawImage(x, y, self.originalImage)
+			if self.fillMode == FILL_SOLID:
+				p.drawRect(self.clipRect)
+			else:
+				p.setClipRect(self.clipRect)
+				p.drawImage(QRectF(QPointF(0, 0), QSizeF(self.paddedSize)), self._filledProxy())
+				p.setClipping(False)
+			if scale == self.proxyScale:
+				# without scaling, which is much faster
+				p.save()
+				p.resetTransform()
+				p.drawImage(self.imageOffset * scale, self.proxyImage)
+				p.restore()
+			else:
+				p.drawImage(QRectF(self.imageOffset, QSizeF(self.sourceSize)), self.proxyImage)
 			if self.eraseRect is not None:
 				p.drawRect(self.eraseRect)
 		self.paddedImage = scaledPixmap.toImage()
+		self.paddedPixmap = None
+		self._invalidatePreview()
+		self.paddedKey = self.previewKey
 		self._setPixmapFromImage()
 
-	def _setPixmapFromImage(self):
+	def _filledProxy(self):
+		"""The padded proxy filled using fillMode (only changes with the padded size)"""
+		key = (self.fillMode, self.paddedSize.width(), self.paddedSize.height(),
+			self.imageOffset.x(), self.imageOffset.y())
+		if self.filledProxy is None or self.filledProxy[0] != key:
+			scale = self._paddedScale()
+			size = QSize(round(self.paddedSize.width() * scale), round(self.paddedSize.height() * scale))
+			offset = QPoint(round(self.imageOffset.x() * scale), round(self.imageOffset.y() * scale))
+			source, transform = self._fillSource()
+			if self.fillMode == FILL_BLUR and self.blurred is None:
+				self.blurred = blurImage(self.proxyImage if transform is None else source)
+			image = self.proxyImage
+			if scale != self.proxyScale:
+				image = image.scaled(
+					round(self.sourceSize.width() * scale), round(self.sourceSize.height() * scale),
+					Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+			if transform is not None:
+				width = round(self.originalImage.width() * scale)
+				if source.width() != width:
+					source = source.scaled(width, round(self.originalImage.height() * scale),
+						Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+			filled = fillPadding(image, size, offset, self.fillMode,
+				QRect(QPoint(0, 0), size), self.blurred, source, transform)
+			self.filledProxy = (key, filled)
+		return self.filledProxy[1]
+
+	def _fillSource(self, image=None):
+		"""The unrotated image and transform to fill from, if straightened (its corners are empty)"""
+		if not self.angle:
+			return None, None
+		return image if image is not None else self.baseProxy, self._transform()
+
+	def _setPixmapFromImage(self, scaledImage=None):
 		# Needs to be a pixmap for display
-		image = self.paddedImage if not self.preview else self.preview
-		self.scaledImage = image.scaled(
-			self.width(),
-			self.height(),
-			Qt.KeepAspectRatio) # ,Qt.SmoothTransformation)
-		scaledPixmap = QPixmap.fromImage(self.scaledImage)
-		self.setPixmap(scaledPixmap)
+		if self.preview:
+			if scaledImage is None:
+				scaledImage = _scaleForDisplay(self.preview, self.size())
+			self.scaledImage = scaledImage
+			self.setPixmap(QPixmap.fromImage(self.scaledImage))
+			return
+		# kept, so that switching back from a preview is instant
+		if self.paddedPixmap is None or self.paddedPixmap[0] != self.size():
+			scaledImage = _scaleForDisplay(self.paddedImage, self.size())
+			self.paddedPixmap = (self.size(), scaledImage, QPixmap.fromImage(scaledImage))
+		self.scaledImage = self.paddedPixmap[1]
+		self.setPixmap(self.paddedPixmap[2])
 		#update()
 
+	def _invalidatePreview(self):
+		"""Render the preview again (once things settle down) if it has changed"""
+		# copies, as the rects are changed in place
+		key = (QRectF(self.clipRect), self.eraseRect if self.eraseRect is None else QRectF(self.eraseRect),
+			QColor(self.paddingBackground).rgb(), self.fillMode, QSize(self.paddedSize),
+			QPointF(self.imageOffset), self.rotation, self.angle, self.flipped, self.size())
+		if key != self.previewKey:
+			self.previewKey = key
+			self._cancel(self.previewRender)
+			self.previewRender = None
+			self.prerenderTimer.start()
+
+	def _cancel(self, future):
+		# a render that hasn't started yet isn't wanted any more
+		if future is not None:
+			future.cancel()
+
+	def _cancelRenders(self):
+		self._cancel(self.previewRender)
+		if self.originalRender is not None:
+			self._cancel(self.originalRender[1])
+		self.previewRender = self.originalRender = None
+
+	def _prerenderPreview(self):
+		if self.paddedImage is None:
+			return
+		if self.paddedKey != self.previewKey:
+			self._setPaddedFromImage()
+		self.previewRender = self.prerenderer.submit(_renderPreview,
+			QImage(self.paddedImage), self._previewRect(), self.size())
+
+	def prerenderOriginal(self, path):
+		"""Start loading the original, so that toggleOriginal() is instant"""
+		if self.originalRender is not None:
+			self._cancel(self.originalRender[1])
+		self.originalRender = (path, self.prerenderer.submit(_renderOriginal, path, self.size()))
+
+	def _previewRect(self):
+		origSize = self.paddedImage.size()
+		rect = self._calculateFrameRect(origSize, origSize)
+		return rect.toRect() # can't use rectF with QImage
+
+	def _showRendered(self, rendered):
+		self.preview, scaledImage, size = rendered
+		self._setPixmapFromImage(scaledImage if size == self.size() else None)
+
 	def resizeEvent(self, e):
 		if self.originalImage == None:
 			return
 		self._setPixmapFromImage()
+		self._invalidatePreview()
 
 	def paintEvent(self, e):
 		super().paintEvent(e) # text or pixmap
@@ -160,7 +388,7 @@ class FramedLabel(QLabel):
 		#print(f"The offset is {offset}")
 
 		#print(f"The clipRect is {self.clipRect}")
-		ratio = imageSize.width() / float(self.paddedImage.width())
+		ratio = imageSize.width() / float(self.paddedSize.width())
 		#print(f"ratio {ratio}")
 		x = self.clipRect.x() * ratio
 		y = self.clipRect.y() * ratio
@@ -182,6 +410,7 @@ class FramedLabel(QLabel):
 		return QPoint(x, y)
 
 	def mousePressEvent(self, e):
+		recordMouse("press", e)
 		if self.scaledImage == None or self.preview:
 			return
 		pos = e.pos()
@@ -189,10 +418,11 @@ class FramedLabel(QLabel):
 		self.mouseDownPos = pos
 		self.mousePos = pos
 
-		if (QGuiApplication.keyboardModifiers() & Qt.ShiftModifier) != Qt.KeyboardModifier.NoModifier:
+		if (e.modifiers() & Qt.ShiftModifier) != Qt.KeyboardModifier.NoModifier:
 			self.tmpEraseRect = QRect(pos, pos)
 
 	def mouseMoveEvent(self, e):
+		recordMouse("move", e)
 		if self.scaledImage == None or self.preview:
 			return
 		pos = e.pos()
@@ -211,7 +441,7 @@ class FramedLabel(QLabel):
 
 			movement = e.pos() - pos
 			#print(f"movement {movement}")
-			ratio = self.scaledImage.width() / float(self.paddedImage.width())
+			ratio = self.scaledImage.width() / float(self.paddedSize.width())
 			movement.setX(movement.x() / ratio)
 			movement.setY(movement.y() / ratio)
 
@@ -219,6 +449,7 @@ class FramedLabel(QLabel):
 			self._setPaddedFromImage()
 
 	def mouseReleaseEvent(self, e):
+		recordMouse("release", e)
 		if self.scaledImage == None or self.preview:
 			return
 		pos = e.pos()
@@ -227,7 +458,7 @@ class FramedLabel(QLabel):
 		if self.movingFrame:
 			self.movingFrame = False
 		elif self.tmpEraseRect is not None:
-			ratio = self.paddedImage.width() / float(self.scaledImage.width())
+			ratio = self.paddedSize.width() / float(self.scaledImage.width())
 			topLeft = self.labelToImage(self.tmpEraseRect.topLeft())
 			x = topLeft.x() * ratio
 			y = topLeft.y() * ratio
@@ -243,6 +474,7 @@ class FramedLabel(QLabel):
 		self._setPaddedFromImage()
 
 	def wheelEvent(self, e):
+		recordWheel(e)
 		if self.scaledImage == None or self.preview:
 			return
 		# mouse step = 15 degrees
@@ -256,9 +488,9 @@ class FramedLabel(QLabel):
 
 		# scale steps so that 50 steps == whole image (shortest size)
 		if self.desktopWidth > self.desktopHeight:
-			steps *= (self.paddedImage.height() / 50)
+			steps *= (self.paddedSize.height() / 50)
 		else:
-			steps *= (self.paddedImage.width() / 50)
+			steps *= (self.paddedSize.width() / 50)
 
 		# make sure steps is at least 1
 		if steps > -1 and steps < 0:
@@ -269,11 +501,31 @@ class FramedLabel(QLabel):
 		self.addPadding(steps)
 
 	def saveImage(self, fileName):
-		origSize = self.paddedImage.size()
-		rect = self._calculateFrameRect(origSize, origSize)
+		data, quality = JpegEncoder.fromSettings().save(self._renderClipped(), fileName)
+		stageWritten(fileName, data)
+
+	def _renderClipped(self):
+		"""Renders the clipped part of the padded image at full size"""
+		rect = self._calculateFrameRect(self.paddedSize, self.paddedSize)
 		rect = rect.toRect() # can't use rectF with QImage
-		clipped = self.paddedImage.copy(rect)
-		clipped.save(fileName)
+		source = self._rotateImage(self.originalImage)
+		clipped = QImage(rect.size(), QImage.Format_RGB32)
+		clipped.fill(self.palette().color(self.backgroundRole()))
+		with QPainter(clipped) as p:
+			p.translate(-rect.x(), -rect.y())
+			p.setPen(self.paddingBackground)
+			p.setBrush(self.paddingBackground)
+			if self.fillMode == FILL_SOLID:
+				p.drawRect(self.clipRect)
+			else:
+				unrotated, transform = self._fillSource(self.originalImage)
+				filled = fillPadding(source, self.paddedSize, self.imageOffset.toPoint(),
+					self.fillMode, self.clipRect, self.blurred, unrotated, transform)
+				p.drawImage(self.clipRect.topLeft(), filled)
+			p.drawImage(self.imageOffset, source)
+			if self.eraseRect is not None:
+				p.drawRect(self.eraseRect)
+		return clipped
 
 	def addPadding(self, amount):
 		if self.preview:
@@ -292,11 +544,11 @@ class FramedLabel(QLabel):
 		y = self.clipRect.y()
 
 		# Don't allow the border to go too big
-		if x + width > self.paddedImage.width():
-			width = self.paddedImage.width() - x
+		if x + width > self.paddedSize.width():
+			width = self.paddedSize.width() - x
 			height = width / float(self.desktopWidth) * self.desktopHeight
-		if y + height > self.paddedImage.height():
-			height = self.paddedImage.height() - y
+		if y + height > self.paddedSize.height():
+			height = self.paddedSize.height() - y
 			width = height / float(self.desktopHeight) * self.desktopWidth
 
 		self.clipRect.setWidth(width)
@@ -309,11 +561,14 @@ class FramedLabel(QLabel):
 			self.preview = None
 			self._setPixmapFromImage()
 		else:
-			origSize = self.paddedImage.size()
-			rect = self._calculateFrameRect(origSize, origSize)
-			rect = rect.toRect() # can't use rectF with QImage
-			self.preview = self.paddedImage.copy(rect)
-			self._setPixmapFromImage()
+			self._invalidatePreview()
+			if self.paddedKey != self.previewKey:
+				self._setPaddedFromImage() # eg. moved with the keyboard
+			if self.previewRender is not None:
+				rendered = self.previewRender.result() # usually done by now
+			else:
+				rendered = _renderPreview(self.paddedImage, self._previewRect(), self.size())
+			self._showRendered(rendered)
 
 	def toggleOriginal(self, original):
 		if self.preview:
@@ -321,8 +576,11 @@ class FramedLabel(QLabel):
 			self._setPixmapFromImage()
 			return False
 		else:
-			self.preview = QImage(original)
-			self._setPixmapFromImage()
+			if self.originalRender is not None and self.originalRender[0] == original:
+				rendered = self.originalRender[1].result()
+			else:
+				rendered = _renderOriginal(original, self.size())
+			self._showRendered(rendered)
 			return True
 
 	def moveFrame(self, movement):
@@ -331,28 +589,34 @@ class FramedLabel(QLabel):
 
 		min_x = 0
 		min_y = 0
-		max_x = self.originalImage.width() - self.clipRect.width()
-		max_y = self.originalImage.height() - self.clipRect.height()
+		max_x = self.sourceSize.width() - self.clipRect.width()
+		max_y = self.sourceSize.height() - self.clipRect.height()
 
 		# print(f"moveFrame {min_x} {min_y} {max_x} {max_y}")
-		if self.paddedImage.width() > self.originalImage.width():
-			min_x = int((self.paddedImage.width() - self.originalImage.width()) / 2.0)
+		paddedWidth = self.paddedSize.width()
+		paddedHeight = self.paddedSize.height()
+		if self.overscan:
+			# anywhere in the padded image
+			max_x = paddedWidth - self.clipRect.width()
+			max_y = paddedHeight - self.clipRect.height()
+		if not self.overscan and paddedWidth > self.sourceSize.width():
+			min_x = int((paddedWidth - self.sourceSize.width()) / 2.0)
 			max_x += min_x
-			if self.clipRect.width() > self.originalImage.width():
-				diff = self.clipRect.width() - self.originalImage.width()
+			if self.clipRect.width() > self.sourceSize.width():
+				diff = self.clipRect.width() - self.sourceSize.width()
 				min_x -= diff
 				max_x += diff
 				if min_x < 0: min_x = 0
-				if max_x > self.paddedImage.width() - self.clipRect.width(): max_x = self.paddedImage.width() - self.clipRect.width()
-		if self.paddedImage.height() > self.originalImage.height():
-			min_y = int((self.paddedImage.height() - self.originalImage.height()) / 2.0)
+				if max_x > paddedWidth - self.clipRect.width(): max_x = paddedWidth - self.clipRect.width()
+		if not self.overscan and paddedHeight > self.sourceSize.height():
+			min_y = int((paddedHeight - self.sourceSize.height()) / 2.0)
 			max_y += min_y
-			if self.clipRect.height() > self.originalImage.height():
-				diff = self.clipRect.height() - self.originalImage.height()
+			if self.clipRect.height() > self.sourceSize.height():
+				diff = self.clipRect.height() - self.sourceSize.height()
 				min_y -= diff
 				max_y += diff
 				if min_y < 0: min_y = 0
-				if max_y > self.paddedImage.height() - self.clipRect.height(): max_y = self.paddedImage.height() - self.clipRect.height()
+				if max_y > paddedHeight - self.clipRect.height(): max_y = paddedHeight - self.clipRect.height()
 		# print(f"adjusted {min_x} {min_y} {max_x} {max_y}")
 
 		# Don't allow the user to drag the clip rect off of the image
@@ -364,8 +628,67 @@ class FramedLabel(QLabel):
 		# print(f"adjusted {topLeft}")
 
 		self.clipRect.moveTopLeft(topLeft)
+		self._invalidatePreview()
 		self.update()
 
 	def selectAll(self):
-		self.clipRect = QRect(QPoint(0, 0), self.paddedImage.size())
+		margin = QSize(self.paddingMargin.x(), self.paddingMargin.y())
+		self.clipRect = QRect(self.paddingMargin, self.paddedSize - margin * 2)
+		self._setPaddedFromImage()
+
+	def toggleOverscan(self):
+		"""Allow the crop border to go past the edges of the padded image"""
+		oldOffset = self.imageOffset
+		self.overscan = not self.overscan
+		if self.originalImage is None:
+			return
+		self._setPaddedSize()
+
+		# keep the crop in the same place on the image
+		movement = (self.imageOffset - oldOffset).toPoint()
+		self.clipRect.translate(movement)
+		if self.eraseRect is not None:
+			self.eraseRect.translate(movement)
+		if not self.overscan:
+			self.moveFrame(QPoint(0, 0))
+			self.addPadding(0)
+			self.moveFrame(QPoint(0, 0))
 		self._setPaddedFromImage()
+
+	def rotate(self, quarterTurns):
+		"""Rotate clockwise (or anticlockwise if negative) by 90 degree steps"""
+		self.rotation = (self.rotation + quarterTurns) % 4
+		self._setRotation()
+
+	def flip(self):
+		self.flipped = not self.flipped
+		self._setRotation()
+
+	def _setRotation(self):
+		if self.originalImage is None:
+			return
+		self.preview = None
+		self._setRotatedProxy()
+		self._resetImage()
+
+	def straighten(self, degrees):
+		"""Rotate by a small angle, keeping the crop where it is (as far as possible)"""
+		angle = max(-MAX_ANGLE, min(MAX_ANGLE, self.angle + degrees))
+		if self.originalImage is None or angle == self.angle:
+			return
+		self.angle = angle
+		self.preview = None
+		self._setRotatedProxy()
+		self._setPaddedSize()
+		self.moveFrame(QPoint(0, 0))
+		self.addPadding(0)
+		self.moveFrame(QPoint(0, 0))
+		self._setPaddedFromImage()
+
+	def setFillMode(self, mode):
+		if mode != FILL_SOLID and importlib.util.find_spec("numpy") is None:
+			print("NumPy is needed to fill the padding with "+mode)
+			return
+		self.fillMode = mode
+		if self.originalImage is not None:
+			self._setPaddedFromImage()
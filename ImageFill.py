@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+"""Padding fills for when the crop extends past the edges of the image.
+
+The padded image is the image placed on a larger canvas. These fill the
+rest of the canvas by:
+	FILL_SOLID		a solid colour (drawn by FramedLabel)
+	FILL_EDGE		repeating the edge pixels
+	FILL_MIRROR		mirroring the image
+	FILL_BLUR		a blurred, enlarged copy of the image
+
+All sizes and positions are in pixels of the image passed in, so the same
+code renders the small display copy and the full size image when saving.
+The edge and mirror fills need NumPy.
+
+A rotated (straightened) image has empty corners, so the fills for it come
+from the image before it was rotated.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+	from PySide6.QtGui import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+		from PySide2.QtGui import *
+	except Exception:
+		from PySide.QtCore import *
+		from PySide.QtGui import *
+from QPainter import *
+
+FILL_SOLID = "solid"
+FILL_EDGE = "edge"
+FILL_MIRROR = "mirror"
+FILL_BLUR = "blur"
+FILL_MODES = [FILL_SOLID, FILL_EDGE, FILL_MIRROR, FILL_BLUR]
+
+BLUR_SIZE = 48		# size of the image that is blurred (then enlarged)
+BLUR_RADIUS = 2
+BLUR_PASSES = 3		# three box blurs are close to a gaussian blur
+FILL_ROWS = 256		# rows mapped through a transform at once (limits memory use)
+
+
+def imageToArray(image):
+	"""Returns a copy of the image as a height x width x 4 (BGRA) array"""
+	import numpy
+	image = image.convertToFormat(QImage.Format_RGB32)
+	data = numpy.frombuffer(image.constBits(), numpy.uint8)
+	data = data[:image.bytesPerLine() * image.height()]
+	data = data.reshape(image.height(), image.bytesPerLine())
+	# copy, as the data goes away with the image
+	return data[:, :image.width() * 4].reshape(image.height(), image.width(), 4).copy()
+
+def arrayToImage(array):
+	"""Returns a QImage of a height x width x 4 (BGRA) array"""
+	import numpy
+	array = numpy.ascontiguousarray(array, numpy.uint8)
+	height, width = array.shape[:2]
+	image = QImage(array.data, width, height, width * 4, QImage.Format_RGB32)
+	return image.copy() # the array data goes away
+
+def _edgeIndexes(indexes, size):
+	import numpy
+	return numpy.clip(indexes, 0, size - 1)
+
+def _mirrorIndexes(indexes, size):
+	import numpy
+	indexes = numpy.mod(indexes, 2 * size)
+	return numpy.where(indexes < size, indexes, 2 * size - 1 - indexes)
+
+def _boxBlur(array, radius, axis):
+	import numpy
+	padding = [(0, 0)] * array.ndim
+	padding[axis] = (radius + 1, radius)
+	total = numpy.cumsum(numpy.pad(array, padding, mode="edge"), axis=axis)
+	upper = numpy.take(total, range(2 * radius + 1, total.shape[axis]), axis=axis)
+	lower = numpy.take(total, range(0, total.shape[axis] - 2 * radius - 1), axis=axis)
+	return (upper - lower) / (2 * radius + 1)
+
+def blurImage(image):
+	"""Returns a small, blurred copy of the image"""
+	import numpy
+	small = image.scaled(BLUR_SIZE, BLUR_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+	array = imageToArray(small).astype(numpy.float32)
+	for i in range(BLUR_PASSES):
+		array = _boxBlur(array, BLUR_RADIUS, 0)
+		array = _boxBlur(array, BLUR_RADIUS, 1)
+	return arrayToImage(array.round())
+
+def _fillTransformed(source, transform, offset, rect, indexes):
+	"""Maps each canvas pixel back to the source, then fills from there"""
+	import numpy
+	array = imageToArray(source)
+	height, width = array.shape[:2]
+	inverse = QImage.trueMatrix(transform, width, height).inverted()[0]
+	xs = (numpy.arange(rect.width()) + rect.x() - offset.x() + 0.5).astype(numpy.float32) # pixel centres
+	filled = numpy.empty((rect.height(), rect.width(), 4), numpy.uint8)
+	for top in range(0, rect.height(), FILL_ROWS):
+		ys = numpy.arange(top, min(top + FILL_ROWS, rect.height())) + rect.y() - offset.y() + 0.5
+		ys = ys.astype(numpy.float32)[:, None]
+		columns = indexes(numpy.floor(inverse.m11() * xs + (inverse.m21() * ys + inverse.dx())).astype(numpy.int32), width)
+		rows = indexes(numpy.floor(inverse.m12() * xs + (inverse.m22() * ys + inverse.dy())).astype(numpy.int32), height)
+		filled[top:top + len(ys)] = array[rows, columns]
+	return arrayToImage(filled)
+
+def _drawCover(p, blurred, canvasSize, transform):
+	"""Draws blurred, transformed about the centre of the canvas, enlarged to cover it"""
+	linear = QTransform(transform.m11(), transform.m12(), transform.m21(), transform.m22(), 0, 0)
+	inverse = linear.inverted()[0]
+	w = canvasSize.width() / 2.0
+	h = canvasSize.height() / 2.0
+	scale = 0
+	for corner in (QPointF(-w, -h), QPointF(w, -h), QPointF(-w, h), QPointF(w, h)):
+		corner = inverse.map(corner)
+		scale = max(scale, 2 * abs(corner.x()) / blurred.width(), 2 * abs(corner.y()) / blurred.height())
+	p.save()
+	p.translate(w, h)
+	p.setTransform(linear, True)
+	width = blurred.width() * scale
+	height = blurred.height() * scale
+	p.drawImage(QRectF(-width / 2, -height / 2, width, height), blurred)
+	p.restore()
+
+def fillPadding(image, canvasSize, offset, mode, rect, blurred=None, source=None, transform=None):
+	"""Returns the rect part of the canvas, with the image at offset and the rest filled.
+
+	blurred is the result of blurImage() (so it can be reused). If image is
+	source rotated by transform, the fill comes from source (and blurred
+	should be of source). The edge and mirror fills then leave the image to
+	be drawn on top by the caller.
+	"""
+	if mode in (FILL_EDGE, FILL_MIRROR):
+		import numpy
+		indexes = _edgeIndexes if mode == FILL_EDGE else _mirrorIndexes
+		if transform is not None:
+			return _fillTransformed(source, transform, offset, rect, indexes)
+		xs = indexes(numpy.arange(rect.width()) + rect.x() - offset.x(), image.width())
+		ys = indexes(numpy.arange(rect.height()) + rect.y() - offset.y(), image.height())
+		array = numpy.take(imageToArray(image), ys, axis=0)
+		return arrayToImage(numpy.take(array, xs, axis=1))
+
+	filled = QImage(rect.size(), QImage.Format_RGB32)
+	filled.fill(Qt.black)
+	with QPainter(filled) as p:
+		p.translate(-rect.x(), -rect.y())
+		if mode == FILL_BLUR:
+			if blurred is None:
+				blurred = blurImage(image if transform is None else source)
+			p.setRenderHint(QPainter.SmoothPixmapTransform)
+			if transform is not None:
+				_drawCover(p, blurred, canvasSize, transform)
+			else:
+				# enlarge to cover the canvas
+				cover = blurred.size().scaled(canvasSize, Qt.KeepAspectRatioByExpanding)
+				target = QRectF(
+					(canvasSize.width() - cover.width()) / 2.0,
+					(canvasSize.height() - cover.height()) / 2.0,
+					cover.width(), cover.height())
+				p.drawImage(target, blurred)
+		p.drawImage(offset, image)
+	return filled
@@ -12,9 +12,12 @@ except Exception:
 		from PySide.QtCore import *
 		from PySide.QtGui import *
 from Ui_ImageWindow import *
+from WallpaperFiles import *
+import StagingCache
+from EventRecorder import *
+from ImageFill import *
+import BatchCommit
 import os
-import shutil
-import filecmp
 
 FORWARDS = False
 BACKWARDS = True
@@ -22,24 +25,25 @@ VIEW_ALL = object()
 VIEW_UNUSED_ORIGINALS = object()
 VIEW_CROPPED = object()
 VIEW_UNCROPPED = object()
-
-
-def forceExt(path, ext):
-	file = os.path.basename(path)
-	path = os.path.dirname(path)
-	return path + "/" + os.path.splitext(file)[0] + "." + ext
-
-def forceJpeg(path):
-	return forceExt(path, "jpg")
+MARK_REMOVE = "remove"
+MARK_ORIGINAL = "use original"
+MARK_KEEP = "keep"
+PREFETCH = 2			# images either side of the current one to prefetch
+STRAIGHTEN_STEP = 0.5	# degrees
 
 class ImageWindow(QMainWindow):
 
 	image = None
 	ui = None
 	viewMode = VIEW_ALL
+	markMode = False
+	marks = None			# image path -> MARK_ value
+	lastBatch = None		# journal of the last committed batch
+	title = ""				# window title without the mark
 
 	def __init__(self):
 		super().__init__()
+		self.marks = {}
 		self.ui = Ui_ImageWindow()
 		self.ui.setupUi(self)
 
@@ -66,6 +70,8 @@ class ImageWindow(QMainWindow):
 		# path buttons need to read/save config
 		self.ui.wallpaper.setSettingsKey("wallpaper")
 		self.ui.originals.setSettingsKey("originals")
+		for journal in BatchCommit.unfinished(self._batchDir()):
+			print("Batch "+journal+" was interrupted, use BatchCommit.py to resume or undo it")
 
 		# help button
 		self.ui.helpBtn.toggled.connect(self._toggleHelp)
@@ -93,6 +99,14 @@ class ImageWindow(QMainWindow):
 			self._selectNextImage(FORWARDS)
 			print("Loaded path image?")
 
+	def showEvent(self, e):
+		# where a recorded session starts from
+		recordStart(
+			image=os.path.basename(getattr(self, "imagePath", "")),
+			desktop=[self.ui.label.desktopWidth, self.ui.label.desktopHeight],
+			window=[self.width(), self.height()])
+		super().showEvent(e)
+
 	def dragEnterEvent(self, e):
 		file = e.mimeData().urls()[0].toLocalFile().strip()
 		self.ui.label.setText(file)
@@ -133,23 +147,25 @@ class ImageWindow(QMainWindow):
 			elif self.viewMode == VIEW_CROPPED:
 				if file == wallpaperPath and \
 						os.path.isfile(backupPath) and \
-						not filecmp.cmp(file, backupPath):
+						not sameImage(file, backupPath):
 					pass
 				elif not force:
 					raise Exception("Not a cropped image")
 			elif self.viewMode == VIEW_UNCROPPED:
 				if file == wallpaperPath and \
 						os.path.isfile(backupPath) and \
-						filecmp.cmp(file, backupPath):
+						sameImage(file, backupPath):
 					pass
 				elif not force:
 					raise Exception("Not an uncropped image")
 
 		# make sure the image is valid
-		image = QImage(file)
+		with stagedPath(file) as local:
+			image = loadImage(local)
 		assert(image.isNull() == False)
 		self.ui.label.setImage(image)
 		self.imagePath = file # for forwards/backwards moving
+		self._updateMode() # a new image isn't rotated
 		settings = QSettings()
 		settings.setValue("image", file) # for close/reopen
 
@@ -159,16 +175,19 @@ class ImageWindow(QMainWindow):
 			backupPath, wallpaperPath = self._getPaths()
 			if file != backupPath and \
 				os.path.isfile(backupPath) and \
-					not filecmp.cmp(file, backupPath):
+					not sameImage(file, backupPath):
 				title += "*"
+				self.ui.label.prerenderOriginal(backupPath)
 		except Exception as e:
 			print("Error checking if backup and wallpaper differ?! "+str(e))
-		self.setWindowTitle(title)
+		self._setTitle(title)
+		self._prefetchNeighbours()
 
 	def eventFilter(self, object, e):
 		# I only want the key press events
 		if e.type() != QEvent.KeyPress:
 			return False
+		recordKey(e)
 
 		handled = True
 		modifiers = e.modifiers()
@@ -177,6 +196,9 @@ class ImageWindow(QMainWindow):
 			if   key == Qt.Key_S: 			self._useCroppedImage()				# control + S = use cropped image
 			elif key == Qt.Key_R: 			self._useOriginalImage()			# control + R = use original image
 			elif key == Qt.Key_A: 			self.ui.label.selectAll()			# control + A = select all
+			elif key == Qt.Key_Return:		self._commitMarks()					# control + Return = commit marked images
+			elif key == Qt.Key_Enter:		self._commitMarks()
+			elif key == Qt.Key_Z:			self._undoBatch()					# control + Z = undo the last commit
 			else: handled = False
 		elif modifiers & Qt.ShiftModifier:
 			if   key == Qt.Key_Right:		self._moveFrame(1, 0)				# Shift + Arrow = move frame (precise)
@@ -185,6 +207,9 @@ class ImageWindow(QMainWindow):
 			elif key == Qt.Key_Down:		self._moveFrame(0, 1)
 			elif key == Qt.Key_O:			self._toggleUnusedOriginals()		# Shift + O = toggle unused originals
 			elif key == Qt.Key_C:			self._toggleCroppedImages()			# Shift + C = toggle cropped images
+			elif key == Qt.Key_M:			self._toggleMarkMode()				# Shift + M = toggle mark mode
+			elif key == Qt.Key_BraceLeft:	self._straighten(-STRAIGHTEN_STEP)	# Shift + [/] = straighten
+			elif key == Qt.Key_BraceRight:	self._straighten(STRAIGHTEN_STEP)
 			else: handled = False
 		else:
 			if   key == Qt.Key_Right:		self._selectNextImage(FORWARDS)		# Right = Next
@@ -196,6 +221,12 @@ class ImageWindow(QMainWindow):
 			elif key == Qt.Key_Space:		self._togglePreview()				# Space = toggle preview
 			elif key == Qt.Key_Backspace:	self._removeImage()					# Do not use image
 			elif key == Qt.Key_B:			self._toggleBackground()			# Toggle background colour
+			elif key == Qt.Key_K:			self._markImage(MARK_KEEP)			# Keep image (mark mode)
+			elif key == Qt.Key_F:			self._cycleFillMode()				# Change how the padding is filled
+			elif key == Qt.Key_E:			self._toggleOverscan()				# Allow the crop past the padding
+			elif key == Qt.Key_BracketLeft:	self._rotate(-1)					# [/] = rotate 90 degrees
+			elif key == Qt.Key_BracketRight:	self._rotate(1)
+			elif key == Qt.Key_H:			self._flip()						# Flip horizontally
 			else: handled = False
 
 		if handled:
@@ -251,42 +282,38 @@ class ImageWindow(QMainWindow):
 				pass # keep looking
 
 
+	def _prefetchNeighbours(self):
+		"""Fetch the images either side (and their originals) into the staging cache"""
+		if StagingCache.stagingCache() is None:
+			return
+		path = os.path.dirname(self.imagePath)
+		files = self._getImages(path)
+		try:
+			index = files.index(os.path.basename(self.imagePath))
+		except ValueError:
+			return
+		originals = str(self.ui.originals.path)
+		paths = []
+		for distance in range(1, PREFETCH + 1):
+			for i in (index + distance, index - distance): # nearest first
+				if 0 <= i < len(files):
+					paths.append(path + "/" + files[i])
+					if path != originals:
+						# not looking for other extensions, that would be slow over the network
+						paths.append(originals + "/" + files[i])
+		StagingCache.prefetch(paths)
+
 	def _getImages(self, path):
 		#print(f"_getImages {path}")
 		allFiles = os.listdir(path)
 		#print(f"allFiles {allFiles}")
 		allFiles.sort()
-		files = []
-		for f in allFiles:
-			# skip hidden (dot) files
-			if f[0] == ".": continue
-			for fmt in QImageReader.supportedImageFormats():
-				ext = "."+bytes(fmt).decode()
-				if f.endswith(ext):
-					files.append(f)
-					break
-		return files
+		return [f for f in allFiles if isImage(f)]
 
 	def _getPaths(self, imagePath = None):
 		if imagePath == None:
 			imagePath = self.imagePath
-		backupPath = self.ui.originals.path
-		wallpaperPath = self.ui.wallpaper.path
-		if not backupPath or not wallpaperPath:
-			print("Both the wallpaper and originals paths must be set!")
-			return None, None
-		fileName = os.path.basename(imagePath)
-		backupPath += "/"+fileName
-		if not os.path.isfile(backupPath):
-			#print("trying alternative backupPath values...")
-			for fmt in QImageReader.supportedImageFormats():
-				altPath = forceExt(backupPath, str(fmt))
-				#print("altPath "+altPath)
-				if os.path.isfile(altPath):
-					backupPath = altPath
-					break
-		wallpaperPath += "/"+fileName
-		return backupPath, wallpaperPath
+		return getPaths(imagePath, self.ui.originals.path, self.ui.wallpaper.path)
 
 	def _useCroppedImage(self):
 		backupPath, wallpaperPath = self._getPaths()
@@ -295,7 +322,7 @@ class ImageWindow(QMainWindow):
 
 		# If original doesn't exist, create it
 		if not os.path.isfile(backupPath):
-			shutil.copy(self.imagePath, backupPath)
+			storeCopy(self.imagePath, backupPath)
 
 		# Save cropped image
 		origWallpaperPath = wallpaperPath
@@ -311,26 +338,15 @@ class ImageWindow(QMainWindow):
 			self._loadFile(self.imagePath, force=True)
 
 	def _useOriginalImage(self):
+		if self.markMode:
+			self._markImage(MARK_ORIGINAL)
+			return
 		backupPath, wallpaperPath = self._getPaths()
 		if not backupPath or not wallpaperPath:
 			return
 
-		# If original doesn't exist, create it
-		if not os.path.isfile(backupPath):
-			if wallpaperPath == self.imagePath:
-				shutil.move(self.imagePath, backupPath)
-			else:
-				shutil.copy(self.imagePath, backupPath)
-
-		# Save uncropped image
 		origWallpaperPath = wallpaperPath
-		if backupPath.endswith(".jpg"):
-			shutil.copy(backupPath, wallpaperPath)
-		else:
-			if os.path.isfile(wallpaperPath):
-				os.remove(wallpaperPath)
-			wallpaperPath = forceJpeg(wallpaperPath)
-			QImage(backupPath).save(wallpaperPath)
+		wallpaperPath = useOriginalImage(self.imagePath, backupPath, wallpaperPath)
 
 		# If the wallpaper image is open, reload it
 		# If another path was opened, do nothing
@@ -350,12 +366,7 @@ class ImageWindow(QMainWindow):
 			if self.ui.label.toggleOriginal(backupPath):
 				self.setWindowTitle(backupPath)
 			else:
-				title = self.imagePath
-				if self.imagePath != backupPath and \
-					os.path.isfile(backupPath) and \
-						not filecmp.cmp(self.imagePath, backupPath):
-					title += "*"
-				self.setWindowTitle(title)
+				self._setTitle(self.title) # as worked out by _loadFile
 
 	def _moveFrame(self, x, y):
 		self.ui.label.moveFrame(QPoint(x, y))
@@ -363,34 +374,112 @@ class ImageWindow(QMainWindow):
 	def _toggleUnusedOriginals(self):
 		if self.viewMode == VIEW_UNUSED_ORIGINALS:
 			self.viewMode = VIEW_ALL
-			self.ui.mode.setText("")
 		else:
 			self.viewMode = VIEW_UNUSED_ORIGINALS
-			self.ui.mode.setText("unused originals")
+		self._updateMode()
 
 	def _toggleCroppedImages(self):
 		if self.viewMode == VIEW_CROPPED:
 			self.viewMode = VIEW_UNCROPPED
-			self.ui.mode.setText("uncropped")
 		elif self.viewMode == VIEW_UNCROPPED:
 			self.viewMode = VIEW_ALL
-			self.ui.mode.setText("")
 		else:
 			self.viewMode = VIEW_CROPPED
-			self.ui.mode.setText("cropped")
+		self._updateMode()
+
+	def _updateMode(self):
+		text = ""
+		if   self.viewMode == VIEW_UNUSED_ORIGINALS:	text = "unused originals"
+		elif self.viewMode == VIEW_CROPPED:				text = "cropped"
+		elif self.viewMode == VIEW_UNCROPPED:			text = "uncropped"
+		if self.ui.label.overscan:
+			text += " extended"
+		angle = self.ui.label.rotation * 90 + self.ui.label.angle
+		if angle:
+			text += " rotated %g\N{DEGREE SIGN}" % angle
+		if self.ui.label.flipped:
+			text += " flipped"
+		if self.ui.label.fillMode != FILL_SOLID:
+			text += " " + self.ui.label.fillMode + " fill"
+		if self.markMode:
+			text += " marking (%d)" % len(self.marks)
+		self.ui.mode.setText(text.strip())
+
+	def _toggleMarkMode(self):
+		self.markMode = not self.markMode
+		self._updateMode()
+
+	def _setTitle(self, title):
+		# show the mark after the file name
+		self.title = title
+		mark = self.marks.get(self.imagePath)
+		if mark:
+			title += " [" + mark + "]"
+		self.setWindowTitle(title)
+
+	def _markImage(self, mark):
+		if not self.markMode:
+			return
+		self.marks[self.imagePath] = mark
+		self._updateMode()
+		self._setTitle(self.title)
+
+	def _batchDir(self):
+		return str(self.ui.wallpaper.path) + "/.batches"
+
+	def _commitMarks(self):
+		if not self.marks:
+			return
+		settings = QSettings()
+		batch = BatchCommit.Batch(self._batchDir(), int(settings.value("batchThreads", 8)))
+		for file, mark in sorted(self.marks.items()):
+			backupPath, wallpaperPath = self._getPaths(file)
+			if not backupPath or not wallpaperPath:
+				return
+			if mark == MARK_REMOVE:
+				batch.add(planRemove(file, backupPath, wallpaperPath))
+			elif mark == MARK_ORIGINAL:
+				batch.add(planUseOriginal(file, backupPath, wallpaperPath))
+		try:
+			self.lastBatch = batch.commit()
+		except Exception as e:
+			print("Failed to commit the marked images: "+str(e))
+			return
+		self.marks = {}
+		self._updateMode()
+		self._reloadImage()
+
+	def _undoBatch(self):
+		# only this session's batch, earlier ones can be undone with BatchCommit.py
+		journal = self.lastBatch
+		if journal is None:
+			print("No batch to undo (use BatchCommit.py undo for earlier batches)")
+			return
+		try:
+			BatchCommit.undo(journal)
+		except Exception as e:
+			print("Failed to undo "+journal+": "+str(e))
+			return
+		self.lastBatch = None
+		self._reloadImage()
+
+	def _reloadImage(self):
+		# the image may have been moved or converted
+		for file in (self.imagePath, forceJpeg(self.imagePath)):
+			if os.path.isfile(file):
+				self._loadFile(file, force=True)
+				return
+		self._selectNextImage(FORWARDS)
 
 	def _removeImage(self):
+		if self.markMode:
+			self._markImage(MARK_REMOVE)
+			return
 		backupPath, wallpaperPath = self._getPaths()
 		if not backupPath or not wallpaperPath:
 			return
 
-		# If original doesn't exist, create it
-		if not os.path.isfile(backupPath):
-			shutil.move(self.imagePath, backupPath)
-
-		# only remove the wallpaper (not an out-of-wallpaper image)
-		if self.imagePath == wallpaperPath:
-			os.remove(self.imagePath)
+		runSteps(planRemove(self.imagePath, backupPath, wallpaperPath))
 
 	def _toggleHelp(self, visible):
 		if visible:
@@ -398,6 +487,28 @@ class ImageWindow(QMainWindow):
 		else:
 			self.ui.help.hide()
 
+	def _cycleFillMode(self):
+		modes = FILL_MODES
+		mode = modes[(modes.index(self.ui.label.fillMode) + 1) % len(modes)]
+		self.ui.label.setFillMode(mode)
+		self._updateMode()
+
+	def _toggleOverscan(self):
+		self.ui.label.toggleOverscan()
+		self._updateMode()
+
+	def _rotate(self, quarterTurns):
+		self.ui.label.rotate(quarterTurns)
+		self._updateMode()
+
+	def _flip(self):
+		self.ui.label.flip()
+		self._updateMode()
+
+	def _straighten(self, degrees):
+		self.ui.label.straighten(degrees)
+		self._updateMode()
+
 	def _toggleBackground(self):
 		bg = Qt.black
 		if self.ui.label.paddingBackground == Qt.black:
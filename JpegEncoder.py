@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""Save wallpapers as JPEGs of a chosen size or quality.
+
+QImage.save() uses Qt's default quality, which gives files that are
+either larger than needed or occasionally blocky. The encoder can
+instead search for the JPEG quality that hits a target file size or
+a target PSNR (in dB), encoding several candidate qualities at once.
+
+The options are read from the settings (see fromSettings()):
+	jpegQuality		fixed quality (0-100) when no target is set
+	jpegTargetBytes	largest file size allowed
+	jpegTargetPsnr	smallest PSNR allowed (needs NumPy)
+	jpegProgressive	write progressive JPEGs
+	jpegOptimize	write optimised Huffman tables
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+	from PySide6.QtGui import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+		from PySide2.QtGui import *
+	except Exception:
+		from PySide.QtCore import *
+		from PySide.QtGui import *
+from ImageFill import *
+import os
+import math
+import time
+import concurrent.futures
+
+MIN_QUALITY = 5
+MAX_QUALITY = 100
+
+
+def parseSize(text):
+	"""Parses sizes like 800000, 800k, 1.5M or 2G into bytes"""
+	text = str(text).strip().lower()
+	scale = 1
+	for suffix, value in (("k", 1000), ("m", 1000 * 1000), ("g", 1000 * 1000 * 1000)):
+		if text.endswith(suffix):
+			text = text[:-1]
+			scale = value
+	return int(float(text) * scale)
+
+def _toBool(value):
+	# QSettings gives back strings on some platforms
+	if isinstance(value, str):
+		return value.lower() in ("1", "true", "yes")
+	return bool(value)
+
+def psnr(reference, data):
+	"""PSNR (in dB) of the encoded data compared to the reference array"""
+	import numpy
+	decoded = imageToArray(QImage.fromData(data, "JPG"))[:, :, :3]
+	error = numpy.mean((reference.astype(numpy.float32) - decoded) ** 2)
+	if error == 0:
+		return float("inf")
+	return 10 * math.log10(255.0 * 255.0 / error)
+
+
+class JpegEncoder:
+	"""Encodes images as JPEG, optionally searching for the best quality.
+
+	This holds only plain values so that it can be handed to worker
+	processes by the batch tools.
+	"""
+
+	quality = -1			# Qt default
+	targetBytes = None		# largest acceptable file
+	targetPsnr = None		# lowest acceptable quality (dB)
+	progressive = False
+	optimize = False
+	threads = None			# number of candidates encoded at once
+
+	def __init__(self, quality=-1, targetBytes=None, targetPsnr=None,
+			progressive=False, optimize=False, threads=None):
+		self.quality = quality
+		self.targetBytes = targetBytes
+		self.targetPsnr = targetPsnr
+		self.progressive = progressive
+		self.optimize = optimize
+		self.threads = threads or min(8, os.cpu_count() or 1)
+
+	@staticmethod
+	def fromSettings():
+		settings = QSettings()
+		targetBytes = settings.value("jpegTargetBytes")
+		targetPsnr = settings.value("jpegTargetPsnr")
+		return JpegEncoder(
+			quality=int(settings.value("jpegQuality", -1)),
+			targetBytes=parseSize(targetBytes) if targetBytes else None,
+			targetPsnr=float(targetPsnr) if targetPsnr else None,
+			progressive=_toBool(settings.value("jpegProgressive", False)),
+			optimize=_toBool(settings.value("jpegOptimize", False)))
+
+	def encode(self, image, quality):
+		"""Returns the JPEG data for the image at the given quality"""
+		buffer = QBuffer()
+		buffer.open(QIODevice.WriteOnly)
+		writer = QImageWriter(buffer, b"jpg")
+		writer.setQuality(quality)
+		try:
+			writer.setProgressiveScanWrite(self.progressive)
+			writer.setOptimizedWrite(self.optimize)
+		except AttributeError:
+			pass # not available before Qt 5.5
+		if not writer.write(image):
+			raise Exception("Failed to encode JPEG: " + writer.errorString())
+		return bytes(buffer.data())
+
+	def _search(self, evaluate, below):
+		"""Binary search (several candidates at a time) for the quality boundary.
+
+		below(result) must be true for low qualities and false above some
+		quality. Returns the highest quality where below() is true (or one
+		less than MIN_QUALITY if there isn't one) and the results by quality.
+		"""
+		results = {}
+		lo = MIN_QUALITY - 1
+		hi = MAX_QUALITY + 1
+		with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+			while hi - lo > 1:
+				count = min(self.threads, hi - lo - 1)
+				qualities = sorted(set(lo + (hi - lo) * i // (count + 1) for i in range(1, count + 1)))
+				for quality, result in zip(qualities, pool.map(evaluate, qualities)):
+					results[quality] = result
+				for quality in qualities:
+					if below(results[quality]):
+						lo = quality
+					else:
+						hi = quality
+						break
+		return lo, results
+
+	def encodeImage(self, image):
+		"""Returns (data, quality) using the configured options.
+
+		With a target size, this is the best quality that fits. With a
+		target PSNR it is the smallest file that is good enough. If both
+		are set, the size limit wins.
+		"""
+		if self.targetBytes is None and self.targetPsnr is None:
+			return self.encode(image, self.quality), self.quality
+
+		if self.targetPsnr is not None:
+			reference = imageToArray(image)[:, :, :3]
+			def evaluate(quality):
+				data = self.encode(image, quality)
+				return data, psnr(reference, data)
+			lo, results = self._search(evaluate, lambda r: r[1] < self.targetPsnr)
+			quality = min(lo + 1, MAX_QUALITY)
+			data = results[quality][0] if quality in results else self.encode(image, quality)
+			if self.targetBytes is None or len(data) <= self.targetBytes:
+				return data, quality
+			print("PSNR %.1f dB does not fit in %d bytes" % (self.targetPsnr, self.targetBytes))
+
+		lo, results = self._search(lambda quality: self.encode(image, quality),
+			lambda data: len(data) <= self.targetBytes)
+		if lo < MIN_QUALITY:
+			print("Can not fit in %d bytes, using the lowest quality" % self.targetBytes)
+			lo = MIN_QUALITY
+		data = results[lo] if lo in results else self.encode(image, lo)
+		return data, lo
+
+	def save(self, image, fileName):
+		"""Saves the image as a JPEG, logging the size and quality.
+
+		Returns the JPEG data and quality.
+		"""
+		start = time.time()
+		data, quality = self.encodeImage(image)
+
+		# write next to the destination and then swap it in
+		tmpName = os.path.join(os.path.dirname(fileName), "." + os.path.basename(fileName) + ".tmp")
+		with open(tmpName, "wb") as f:
+			f.write(data)
+		os.replace(tmpName, fileName)
+
+		print("Saved %s: %dx%d, %d bytes, quality %s, %.0f ms" % (
+			fileName, image.width(), image.height(), len(data),
+			quality if quality >= 0 else "default", (time.time() - start) * 1000))
+		return data, quality
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+"""Replays a recorded session (see EventRecorder.py) to measure performance.
+
+The app runs headless (Qt's offscreen platform) against a copy of an image
+corpus, so the corpus itself is never changed. The corpus is a folder of
+wallpapers, or a folder with wallpaper and originals folders inside it.
+
+	python3 Replay.py session.jsonl corpus [--runs N] [--json results.json]
+
+For each type of event, the time taken to handle it (including any
+repaints it caused) is reported as percentiles, along with the number of
+frames painted. Use the same session and corpus to compare releases.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+# must be set before Qt is loaded
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import EventRecorder
+EventRecorder.recordPath = None # don't record the replay
+
+try:
+	from PySide6.QtCore import *
+	from PySide6.QtGui import *
+	from PySide6.QtWidgets import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+		from PySide2.QtGui import *
+		from PySide2.QtWidgets import *
+	except Exception:
+		from PySide.QtCore import *
+		from PySide.QtGui import *
+
+MOUSE_EVENTS = {
+	"press": QEvent.MouseButtonPress,
+	"move": QEvent.MouseMove,
+	"release": QEvent.MouseButtonRelease,
+}
+
+
+class FrameCounter(QObject):
+	"""Counts the paint events of a widget"""
+
+	frames = 0
+
+	def eventFilter(self, object, e):
+		if e.type() == QEvent.Paint:
+			self.frames += 1
+		return False
+
+
+def _modifiers(value):
+	try:
+		return Qt.KeyboardModifier(value)
+	except Exception:
+		return Qt.KeyboardModifiers(value) # PySide 2
+
+def _buttons(value):
+	try:
+		return Qt.MouseButton(value)
+	except Exception:
+		return Qt.MouseButtons(value)
+
+def makeEvent(entry):
+	"""Returns the Qt event for a recorded entry"""
+	kind = entry["type"]
+	modifiers = _modifiers(entry.get("modifiers", 0))
+	if kind == "key":
+		return QKeyEvent(QEvent.KeyPress, entry["key"], modifiers)
+	pos = QPointF(entry["x"], entry["y"])
+	if kind == "wheel":
+		return QWheelEvent(pos, pos, QPoint(0, 0), QPoint(0, entry["delta"]),
+			Qt.NoButton, modifiers, Qt.NoScrollPhase, False)
+	return QMouseEvent(MOUSE_EVENTS[kind], pos, pos,
+		_buttons(entry["button"]), _buttons(entry["buttons"]), modifiers)
+
+def percentile(values, p):
+	values = sorted(values)
+	index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+	return values[index]
+
+
+def replay(app, session, corpus, realtime=False):
+	"""Replays the session once, returning {type: [latency seconds]} and the frame count"""
+	from ImageWindow import ImageWindow
+
+	entries = [json.loads(line) for line in open(session) if line.strip()]
+	start = entries[0] if entries and entries[0]["type"] == "start" else {}
+
+	# work on a copy, as the session may save or remove images
+	tmp = tempfile.mkdtemp(prefix="wallpaper-replay-")
+	try:
+		wallpaper = tmp + "/wallpaper"
+		originals = tmp + "/originals"
+		if os.path.isdir(corpus + "/wallpaper"):
+			shutil.copytree(corpus + "/wallpaper", wallpaper)
+		else:
+			shutil.copytree(corpus, wallpaper, ignore=shutil.ignore_patterns("originals"))
+		if os.path.isdir(corpus + "/originals"):
+			shutil.copytree(corpus + "/originals", originals)
+		else:
+			os.mkdir(originals)
+
+		settings = QSettings()
+		settings.clear()
+		settings.setValue("wallpaper", wallpaper)
+		settings.setValue("originals", originals)
+		if "desktop" in start:
+			settings.setValue("desktopWidth", start["desktop"][0])
+			settings.setValue("desktopHeight", start["desktop"][1])
+		if start.get("image"):
+			settings.setValue("image", wallpaper + "/" + start["image"])
+
+		window = ImageWindow()
+		if "window" in start:
+			window.resize(*start["window"])
+		window.show()
+		label = window.ui.label
+		counter = FrameCounter()
+		label.installEventFilter(counter)
+		app.processEvents()
+
+		latencies = {}
+		frames = counter.frames
+		began = time.perf_counter()
+		for entry in entries:
+			if entry["type"] == "start":
+				continue
+			if realtime:
+				delay = entry["t"] - (time.perf_counter() - began)
+				if delay > 0:
+					time.sleep(delay)
+			e = makeEvent(entry)
+			t0 = time.perf_counter()
+			QApplication.sendEvent(label, e)
+			app.processEvents() # includes the repaint
+			latencies.setdefault(entry["type"], []).append(time.perf_counter() - t0)
+		frames = counter.frames - frames
+
+		window.close()
+		window.deleteLater()
+		app.processEvents()
+		return latencies, frames
+	finally:
+		shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Replay a recorded session and report latencies")
+	parser.add_argument("session", help="file recorded with WALLPAPER_RECORD")
+	parser.add_argument("corpus", help="folder of images to replay against")
+	parser.add_argument("-r", "--runs", type=int, default=1, help="number of times to replay")
+	parser.add_argument("--realtime", action="store_true", help="keep the recorded timing")
+	parser.add_argument("--json", default=None, help="also write the results to this file")
+	args = parser.parse_args()
+
+	app = QApplication(sys.argv[:1])
+	app.setOrganizationName("OpenGear")
+	app.setApplicationName("WallpaperHelperReplay") # don't touch the real settings
+
+	latencies = {}
+	frames = 0
+	for run in range(args.runs):
+		runLatencies, runFrames = replay(app, args.session, args.corpus, args.realtime)
+		for kind, values in runLatencies.items():
+			latencies.setdefault(kind, []).extend(values)
+		frames += runFrames
+
+	results = {"runs": args.runs, "frames": frames, "events": {}}
+	print("%-8s %6s %8s %8s %8s %8s" % ("event", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+	for kind in sorted(latencies):
+		values = latencies[kind]
+		stats = {
+			"count": len(values),
+			"p50": percentile(values, 50) * 1000,
+			"p90": percentile(values, 90) * 1000,
+			"p99": percentile(values, 99) * 1000,
+			"max": max(values) * 1000,
+		}
+		results["events"][kind] = stats
+		print("%-8s %6d %8.1f %8.1f %8.1f %8.1f" % (kind, stats["count"],
+			stats["p50"], stats["p90"], stats["p99"], stats["max"]))
+	print("%d frame(s) painted in %d run(s)" % (frames, args.runs))
+
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=1)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
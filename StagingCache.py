@@ -0,0 +1,414 @@
+#!/usr/bin/python3
+"""A local copy of images that are kept on slow (eg. network) storage.
+
+Set stagingCacheDir in the settings to a folder on a local disk to use it
+(and stagingCacheBytes for the budget, eg. 2G). Each image is then read
+over the network once and from the local copy after that:
+
+- Copies are looked up by path, modification time and size, so a file
+  that has changed is fetched again rather than served stale
+- The least recently used copies are removed to stay within the budget
+- The app prefetches the images either side of the current one
+- Images saved by the app are written to the cache as well
+
+	python3 StagingCache.py warm [folder ...]	# before a review session
+	python3 StagingCache.py stats
+	python3 StagingCache.py clear
+
+warm uses the wallpaper and originals folders by default.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+	except Exception:
+		from PySide.QtCore import *
+from JpegEncoder import parseSize
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import argparse
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+DEFAULT_BYTES = "2G"
+STATS_FILE = "stats.json"
+PREFETCH_THREADS = 2
+
+
+class StagingCache:
+	"""Local copies of files, looked up by path, modification time and size"""
+
+	path = None
+	maxBytes = None
+	totalBytes = 0
+	entries = None		# cache file name -> (size, inode), least recently used first
+	links = None		# inode -> number of entries for it (copies are hard links)
+	fetching = None		# cache file name -> event set once fetched
+	pinned = None		# cache file name -> number of readers, which aren't removed
+	current = None		# path -> cache file name for it, this session
+	stale = None		# names that are removed once they aren't being read
+	lock = None
+	prefetcher = None
+	prefetches = None	# futures, so that stale prefetches can be cancelled
+
+	# statistics (of files the app asked for, not prefetches)
+	hits = 0
+	misses = 0
+	bytesSaved = 0		# read locally rather than over the network
+	bytesFetched = 0	# read over the network (including prefetches)
+	fetches = 0
+
+	def __init__(self, path, maxBytes):
+		self.path = path
+		self.maxBytes = maxBytes
+		self.fetching = {}
+		self.pinned = collections.Counter()
+		self.current = {}
+		self.stale = set()
+		self.prefetches = []
+		self.lock = threading.Lock()
+		os.makedirs(path, exist_ok=True)
+
+		# the access time gives the least recently used order
+		files = []
+		for f in os.listdir(path):
+			if f.startswith(".") or f == STATS_FILE:
+				continue
+			st = os.stat(path + "/" + f)
+			files.append((st.st_atime, f, st))
+		self.entries = collections.OrderedDict()
+		self.links = {}
+		for atime, f, st in sorted(files, key=lambda file: file[:2]):
+			self._add(f, st, False)
+
+	def _name(self, path, st):
+		key = "%s\0%d\0%d" % (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+		# keep the extension, as Qt uses it to choose the image format
+		return hashlib.sha1(key.encode()).hexdigest() + os.path.splitext(path)[1].lower()
+
+	def get(self, path):
+		"""Returns the local copy of path, or path if it can't be cached.
+
+		The copy isn't removed until release() is called for it.
+		"""
+		return self._get(path, True)
+
+	def release(self, local):
+		"""Allow the copy returned by get() to be removed"""
+		if not local.startswith(self.path + "/"):
+			return # not cached
+		name = os.path.basename(local)
+		with self.lock:
+			self.pinned[name] -= 1
+			if self.pinned[name] > 0:
+				return
+			del self.pinned[name]
+			if name in self.stale:
+				self.stale.discard(name)
+				self._remove(name)
+
+	def _get(self, path, count):
+		try:
+			st = os.stat(path)
+		except OSError:
+			return path # let the caller report it
+		if st.st_size > self.maxBytes:
+			return path
+		name = self._name(path, st)
+		local = self.path + "/" + name
+
+		while True:
+			with self.lock:
+				self._current(path, name)
+				if name in self.entries:
+					self.entries.move_to_end(name)
+					if count:
+						self.hits += 1
+						self.bytesSaved += st.st_size
+						self.pinned[name] += 1
+					event = None
+				else:
+					event = self.fetching.get(name)
+					if event is None:
+						event = self.fetching[name] = threading.Event()
+						break # fetch it
+			if event is None:
+				try:
+					os.utime(local, (time.time(), st.st_mtime))
+					return local
+				except OSError:
+					if count:
+						self.release(local)
+					self._forget(name) # removed by another process
+			else:
+				event.wait() # already being fetched
+
+		try:
+			tmp = "%s/.%s.%d.tmp" % (self.path, name, threading.get_ident())
+			shutil.copyfile(path, tmp)
+			os.replace(tmp, local)
+			localSt = os.stat(local)
+		except OSError as e:
+			print("Failed to cache %s: %s" % (path, e))
+			return path
+		finally:
+			with self.lock:
+				del self.fetching[name]
+			event.set()
+		with self.lock:
+			if count:
+				self.misses += 1
+				self.pinned[name] += 1
+			self.bytesFetched += st.st_size
+			self.fetches += 1
+			self._add(name, localSt)
+		return local
+
+	def _add(self, name, st, evict=True):
+		# lock must be held
+		self._drop(name)
+		self.entries[name] = (st.st_size, st.st_ino)
+		if st.st_ino not in self.links:
+			self.totalBytes += st.st_size # hard links to it take no more space
+		self.links[st.st_ino] = self.links.get(st.st_ino, 0) + 1
+		while evict and self.totalBytes > self.maxBytes:
+			oldest = next((n for n in self.entries if n != name and n not in self.pinned), None)
+			if oldest is None:
+				break # everything else is pinned
+			self._remove(oldest)
+
+	def _current(self, path, name):
+		# lock must be held
+		path = os.path.abspath(path)
+		old = self.current.get(path)
+		self.current[path] = name
+		if old is None or old == name or old not in self.entries:
+			return
+		# the file has changed, so the old copy won't be used again
+		if self.pinned[old]:
+			self.stale.add(old)
+		else:
+			self._remove(old)
+
+	def _remove(self, name):
+		# lock must be held
+		self._drop(name)
+		try:
+			os.remove(self.path + "/" + name)
+		except OSError:
+			pass
+
+	def _drop(self, name):
+		# lock must be held
+		entry = self.entries.pop(name, None)
+		if entry is None:
+			return
+		size, inode = entry
+		self.links[inode] -= 1
+		if not self.links[inode]:
+			del self.links[inode]
+			self.totalBytes -= size
+
+	def _forget(self, name):
+		with self.lock:
+			self._drop(name)
+
+	def written(self, path, data):
+		"""Record data that has just been written to path (write through)"""
+		st = os.stat(path)
+		name = self._name(path, st)
+		tmp = "%s/.%s.%d.tmp" % (self.path, name, threading.get_ident())
+		with open(tmp, "wb") as f:
+			f.write(data)
+		os.replace(tmp, self.path + "/" + name)
+		with self.lock:
+			self._current(path, name)
+			self._add(name, os.stat(self.path + "/" + name))
+
+	def copied(self, src, dst):
+		"""Record that dst is a copy of src (if src is cached)"""
+		srcName = self._name(src, os.stat(src))
+		with self.lock:
+			if srcName not in self.entries:
+				return
+		st = os.stat(dst)
+		name = self._name(dst, st)
+		local = self.path + "/" + name
+		try:
+			if os.path.lexists(local):
+				os.remove(local)
+			os.link(self.path + "/" + srcName, local)
+			st = os.stat(local)
+		except OSError:
+			return
+		with self.lock:
+			self._current(dst, name)
+			self._add(name, st)
+
+	def prefetch(self, paths):
+		"""Fetch files in the background, in the order given.
+
+		Prefetches that haven't started yet are cancelled, as they are for
+		an earlier position.
+		"""
+		if self.prefetcher is None:
+			self.prefetcher = concurrent.futures.ThreadPoolExecutor(PREFETCH_THREADS)
+		for future in self.prefetches:
+			future.cancel()
+		self.prefetches = [self.prefetcher.submit(self._get, path, False) for path in paths]
+
+	def warm(self, folder, threads=4):
+		"""Fetch every image in folder, returning how many were fetched and their size"""
+		from WallpaperFiles import isImage
+		files = [folder + "/" + f for f in sorted(os.listdir(folder)) if isImage(f)]
+		fetches, fetched = self.fetches, self.bytesFetched
+		with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+			list(pool.map(lambda f: self._get(f, False), files))
+		return self.fetches - fetches, self.bytesFetched - fetched
+
+	def saveStats(self):
+		"""Add this session's statistics to the totals in the cache folder"""
+		stats = readStats(self.path)
+		for key, value in self.stats().items():
+			stats[key] += value
+		tmp = "%s/.%s.%d.tmp" % (self.path, STATS_FILE, os.getpid())
+		with open(tmp, "w") as f:
+			json.dump(stats, f, indent=1)
+		os.replace(tmp, self.path + "/" + STATS_FILE)
+		self.hits = self.misses = self.bytesSaved = self.bytesFetched = 0
+		return stats
+
+	def stats(self):
+		"""This session's statistics"""
+		return {"hits": self.hits, "misses": self.misses,
+			"bytesSaved": self.bytesSaved, "bytesFetched": self.bytesFetched}
+
+
+def readStats(path):
+	stats = {"hits": 0, "misses": 0, "bytesSaved": 0, "bytesFetched": 0}
+	try:
+		with open(path + "/" + STATS_FILE) as f:
+			stats.update(json.load(f))
+	except (OSError, ValueError):
+		pass
+	return stats
+
+def formatStats(stats):
+	requests = stats["hits"] + stats["misses"]
+	return "%d hit(s), %d miss(es) (%.0f%% hit rate), %.1f MB read locally, %.1f MB fetched" % (
+		stats["hits"], stats["misses"], 100.0 * stats["hits"] / requests if requests else 0,
+		stats["bytesSaved"] / 1e6, stats["bytesFetched"] / 1e6)
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+def stagingCache():
+	"""The cache set in the settings, or None if there isn't one"""
+	global _cache
+	with _cacheLock:
+		if _cache is None:
+			settings = QSettings()
+			path = settings.value("stagingCacheDir")
+			if not path:
+				return None
+			_cache = StagingCache(str(path), parseSize(settings.value("stagingCacheBytes", DEFAULT_BYTES)))
+			atexit.register(_exit, _cache)
+		return _cache
+
+def _exit(cache):
+	if cache.hits or cache.misses:
+		print("Staging cache: " + formatStats(cache.stats()))
+	cache.saveStats()
+
+@contextlib.contextmanager
+def stagedPath(path):
+	"""The path to read path from (the local copy if there is a cache).
+
+		with stagedPath(path) as local:
+			image = loadImage(local)
+
+	The local copy is kept until the with block ends.
+	"""
+	cache = stagingCache()
+	if cache is None:
+		yield path
+		return
+	local = cache.get(path)
+	try:
+		yield local
+	finally:
+		cache.release(local)
+
+def stageWritten(path, data):
+	cache = stagingCache()
+	if cache:
+		try:
+			cache.written(path, data)
+		except OSError as e:
+			print("Failed to cache %s: %s" % (path, e))
+
+def stageCopy(src, dst):
+	cache = stagingCache()
+	if cache:
+		try:
+			cache.copied(src, dst)
+		except OSError as e:
+			print("Failed to cache %s: %s" % (dst, e))
+
+def prefetch(paths):
+	cache = stagingCache()
+	if cache:
+		cache.prefetch(paths)
+
+
+def main():
+	QCoreApplication.setOrganizationName("OpenGear")
+	QCoreApplication.setApplicationName("WallpaperHelper")
+	settings = QSettings()
+
+	parser = argparse.ArgumentParser(description="Manage the local copy of images")
+	parser.add_argument("command", choices=["warm", "stats", "clear"])
+	parser.add_argument("folders", nargs="*", help="folders to warm (default: wallpaper and originals)")
+	parser.add_argument("-j", "--jobs", type=int, default=4, help="files to fetch at once")
+	args = parser.parse_args()
+
+	cache = stagingCache()
+	if cache is None:
+		parser.error("stagingCacheDir is not set")
+
+	if args.command == "stats":
+		print("%d file(s), %.1f of %.1f MB" % (len(cache.entries), cache.totalBytes / 1e6, cache.maxBytes / 1e6))
+		print(formatStats(readStats(cache.path)))
+	elif args.command == "clear":
+		with cache.lock:
+			for name in cache.entries:
+				try:
+					os.remove(cache.path + "/" + name)
+				except OSError:
+					pass
+			cache.entries.clear()
+			cache.links.clear()
+			cache.totalBytes = 0
+		print("Cleared "+cache.path)
+	else:
+		folders = args.folders or [str(settings.value(key)) for key in ("wallpaper", "originals") if settings.value(key)]
+		for folder in folders:
+			start = time.time()
+			count, size = cache.warm(folder, args.jobs)
+			elapsed = max(time.time() - start, 1e-6)
+			print("%s: fetched %d file(s), %.1f MB in %.1fs (%.1f MB/s)" % (
+				folder, count, size / 1e6, elapsed, size / 1e6 / elapsed))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
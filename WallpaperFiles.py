@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""File handling shared by the app and the batch tools.
+
+Keeping this in one place means that the batch tools apply exactly the
+same naming and overwrite rules as the interactive key presses.
+"""
+
+import sys
+try:
+	from PySide6.QtCore import *
+	from PySide6.QtGui import *
+except Exception:
+	try:
+		from PySide2.QtCore import *
+		from PySide2.QtGui import *
+	except Exception:
+		from PySide.QtCore import *
+		from PySide.QtGui import *
+from JpegEncoder import *
+from StagingCache import stagedPath, stageWritten, stageCopy
+import os
+import shutil
+import filecmp
+
+# How copies between the wallpaper and originals folders are stored
+STORE_COPY = "copy"			# an independent copy
+STORE_HARDLINK = "hardlink"	# a hard link (or reflink, or copy if on different filesystems)
+STORE_REFLINK = "reflink"	# a copy-on-write clone (or copy if unsupported)
+FICLONE = 0x40049409		# Linux ioctl to clone a file
+
+
+def forceExt(path, ext):
+	file = os.path.basename(path)
+	path = os.path.dirname(path)
+	return path + "/" + os.path.splitext(file)[0] + "." + ext
+
+def forceJpeg(path):
+	return forceExt(path, "jpg")
+
+def imageExtensions():
+	return ["."+bytes(fmt).decode() for fmt in QImageReader.supportedImageFormats()]
+
+def isImage(fileName):
+	# skip hidden (dot) files
+	if fileName[0] == ".":
+		return False
+	for ext in imageExtensions():
+		if fileName.endswith(ext):
+			return True
+	return False
+
+def loadImage(path):
+	"""Loads an image, rotated as its EXIF orientation says"""
+	reader = QImageReader(path)
+	try:
+		reader.setAutoTransform(True)
+	except AttributeError:
+		pass # not available before Qt 5.5
+	return reader.read()
+
+def getPaths(imagePath, originalsPath, wallpaperPath):
+	"""Returns the original and wallpaper paths for an image.
+
+	The original might have a different extension to the image.
+	"""
+	if not originalsPath or not wallpaperPath:
+		print("Both the wallpaper and originals paths must be set!")
+		return None, None
+	fileName = os.path.basename(imagePath)
+	backupPath = originalsPath + "/" + fileName
+	if not os.path.isfile(backupPath):
+		#print("trying alternative backupPath values...")
+		for ext in imageExtensions():
+			altPath = forceExt(backupPath, ext[1:])
+			#print("altPath "+altPath)
+			if os.path.isfile(altPath):
+				backupPath = altPath
+				break
+	wallpaperPath += "/" + fileName
+	return backupPath, wallpaperPath
+
+def storageMode():
+	mode = QSettings().value("storageMode", STORE_COPY)
+	if mode not in (STORE_COPY, STORE_HARDLINK, STORE_REFLINK):
+		print("Unknown storageMode "+str(mode)+", copying")
+		mode = STORE_COPY
+	return mode
+
+def _reflink(src, dst):
+	import fcntl
+	try:
+		with open(src, "rb") as s, open(dst, "wb") as d:
+			fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+	except Exception:
+		if os.path.exists(dst):
+			os.remove(dst)
+		raise
+	# matching stats mean filecmp doesn't need to read the files
+	shutil.copystat(src, dst)
+
+def storeCopy(src, dst, mode=None, fallback=True):
+	"""Copy src to dst, sharing the data if the storage mode allows it.
+
+	dst is replaced in one step, so a linked dst is never written through.
+	Returns how the copy was stored (one of the STORE_ values). Without
+	fallback, dst is left alone if the data can't be shared (and STORE_COPY
+	is returned).
+	"""
+	if mode is None:
+		mode = storageMode()
+	tmp = os.path.join(os.path.dirname(dst), "." + os.path.basename(dst) + ".tmp")
+	if os.path.lexists(tmp):
+		os.remove(tmp)
+
+	stored = STORE_COPY
+	if mode == STORE_HARDLINK:
+		try:
+			os.link(src, tmp)
+			stored = STORE_HARDLINK
+		except OSError:
+			pass # eg. on different filesystems
+	if stored == STORE_COPY and mode != STORE_COPY:
+		try:
+			_reflink(src, tmp)
+			stored = STORE_REFLINK
+		except Exception:
+			pass # not supported, copy it
+	if stored == STORE_COPY:
+		if not fallback:
+			return stored
+		with stagedPath(src) as local:
+			shutil.copy(local, tmp)
+	os.replace(tmp, dst)
+	stageCopy(src, dst)
+	return stored
+
+def sameImage(path1, path2):
+	"""True if the files have the same contents.
+
+	Linked files and files of different sizes are recognised without
+	reading them.
+	"""
+	try:
+		if os.path.samefile(path1, path2):
+			return True
+		if os.path.getsize(path1) != os.path.getsize(path2):
+			return False # eg. cropped, without reading either file
+	except OSError:
+		pass
+	with stagedPath(path1) as local1, stagedPath(path2) as local2:
+		return filecmp.cmp(local1, local2)
+
+def runSteps(steps, encoder=None):
+	"""Carry out steps from the plan functions below.
+
+	Each step is an (operation, source, destination) tuple:
+		move		move source to destination
+		copy		storeCopy() source to destination
+		convert		encode source as a JPEG at destination
+		remove		remove source (destination is None)
+	"""
+	for step in steps:
+		runStep(step, encoder)
+
+def runStep(step, encoder=None):
+	op, src, dst = step
+	if op == "move":
+		shutil.move(src, dst)
+	elif op == "copy":
+		storeCopy(src, dst)
+	elif op == "convert":
+		with stagedPath(src) as local:
+			image = loadImage(local)
+		if image.isNull():
+			raise Exception("Failed to load "+src)
+		if encoder is None:
+			encoder = JpegEncoder.fromSettings()
+		data, quality = encoder.save(image, dst)
+		stageWritten(dst, data)
+	elif op == "remove":
+		os.remove(src)
+	else:
+		raise Exception("Unknown step "+str(op))
+
+def planUseOriginal(imagePath, backupPath, wallpaperPath):
+	"""Steps to make the wallpaper an uncropped copy of the original.
+
+	If the original doesn't exist yet, the image becomes the original.
+	A JPEG original is copied as-is, anything else is converted.
+	The last step writes the wallpaper.
+	"""
+	steps = []
+	moved = False
+
+	# If original doesn't exist, create it
+	if not os.path.isfile(backupPath):
+		if wallpaperPath == imagePath:
+			steps.append(("move", imagePath, backupPath))
+			moved = True
+		else:
+			steps.append(("copy", imagePath, backupPath))
+
+	# Save uncropped image
+	if backupPath.endswith(".jpg"):
+		steps.append(("copy", backupPath, wallpaperPath))
+	else:
+		if os.path.isfile(wallpaperPath) and not moved:
+			steps.append(("remove", wallpaperPath, None))
+		steps.append(("convert", backupPath, forceJpeg(wallpaperPath)))
+	return steps
+
+def planRemove(imagePath, backupPath, wallpaperPath):
+	"""Steps to stop using an image, keeping it as an original"""
+	steps = []
+
+	# If original doesn't exist, create it
+	if not os.path.isfile(backupPath):
+		steps.append(("move", imagePath, backupPath))
+
+	# only remove the wallpaper (not an out-of-wallpaper image)
+	elif imagePath == wallpaperPath:
+		steps.append(("remove", imagePath, None))
+	return steps
+
+def useOriginalImage(imagePath, backupPath, wallpaperPath, encoder=None):
+	"""Make the wallpaper an uncropped copy of the original.
+
+	Returns the path of the wallpaper that was written.
+	"""
+	steps = planUseOriginal(imagePath, backupPath, wallpaperPath)
+	runSteps(steps, encoder)
+	return steps[-1][2]